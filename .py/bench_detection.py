@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+NetSupport Monitor - Detection Latency Benchmark
+Measures check_connection() latency and allocations against a synthetic
+psutil backend. Runs on plain Linux: no Windows, tray or NetSupport needed.
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import netsupport_fakeps  # noqa: E402
+from netsupport_fakeps import FakePsutil, load_monitor_module  # noqa: E402
+
+DEFAULT_MONITOR = "netsupport_monitor_en_v0.4.1beta.py"
+METHODS = ("process", "port", "registry", "hybrid")
+# "auto" reads the sockets of known NetSupport PIDs, "system" every socket
+SCOPES = ("auto", "system")
+PORT_METHODS = ("port", "hybrid")
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(samples)
+    index = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+def run_scenario(module, method: str, processes: int, sockets: int, connected: bool,
+                 iterations: int, churn: int, seed: int, scope: str = "auto") -> Dict[str, Any]:
+    """Time `iterations` checks of one method against one synthetic table"""
+    backend = FakePsutil(seed)
+    backend.populate(processes, sockets, connected)
+    previous = netsupport_fakeps.install(backend, module)
+    try:
+        monitor = module.NetSupportMonitorSimple()
+        monitor.config.update({
+            "detection_method": method,
+            "port_backend": "psutil",
+            "port_scope": scope,
+            "event_source": "off",
+        })
+        if hasattr(monitor, "build_detection"):
+            # Monitors without the detector API read detection_method per check
+            monitor.detection = monitor.build_detection()
+
+        # Warm-up fills the incremental scanner and adapter caches
+        monitor.check_connection()
+
+        latencies = []
+        peaks = []
+        results = set()
+        tracemalloc.start()
+        for _ in range(iterations):
+            backend.churn(churn)
+            # Every tick is further apart than cache_ttl in real use, so the
+            # per-PID socket lists are stale as well
+            if hasattr(monitor, "snapshot_cache"):
+                monitor.snapshot_cache.invalidate()
+            elif hasattr(monitor.get_netsupport_processes, "cache_clear"):
+                # Monitors before the snapshot cache used lru_cache
+                monitor.get_netsupport_processes.cache_clear()
+            if hasattr(monitor, "pid_port_probe"):
+                monitor.pid_port_probe.sockets.clear()
+
+            tracemalloc.clear_traces()
+            start_time = time.perf_counter()
+            results.add(monitor.check_connection())
+            latencies.append(time.perf_counter() - start_time)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        if hasattr(monitor, "detection"):
+            monitor.detection.shutdown()
+    finally:
+        netsupport_fakeps.uninstall(previous)
+
+    return {
+        "method": method,
+        "scope": scope,
+        "processes": processes,
+        "sockets": sockets,
+        "connected": connected,
+        "iterations": iterations,
+        "detected": sorted(results),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 4),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 4),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 4),
+        "peak_alloc_kb": round(percentile(peaks, 50) / 1024, 1),
+    }
+
+
+def compare(results: List[Dict[str, Any]], baseline_path: str):
+    """Print p50/p99 changes against an earlier results file"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    def key(row):
+        return (row["method"], row.get("scope", "auto"), row["processes"], row["sockets"],
+                row["connected"])
+
+    old = {key(row): row for row in baseline.get("results", [])}
+    print(f"\n{'scenario':<38} {'p50 ms':>16} {'p99 ms':>16}")
+    for row in results:
+        before = old.get(key(row))
+        if not before:
+            continue
+        name = (f"{row['method']}/{row['scope']} {row['processes']}p/{row['sockets']}s "
+                f"{'on' if row['connected'] else 'off'}")
+        p50 = f"{before['p50_ms']:.2f}->{row['p50_ms']:.2f}"
+        p99 = f"{before['p99_ms']:.2f}->{row['p99_ms']:.2f}"
+        print(f"{name:<38} {p50:>16} {p99:>16}")
+
+
+def parse_sizes(value: str) -> List[int]:
+    """Parse a comma-separated list of sizes"""
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark NetSupport detection latency")
+    parser.add_argument("--monitor", default=DEFAULT_MONITOR,
+                        help="monitor script to benchmark (default: %(default)s)")
+    parser.add_argument("--processes", type=parse_sizes, default=[100, 1000, 10000, 50000],
+                        help="comma-separated process counts")
+    parser.add_argument("--sockets", type=parse_sizes, default=[1000, 20000, 200000],
+                        help="comma-separated socket counts")
+    parser.add_argument("--methods", default=",".join(METHODS),
+                        help="comma-separated detection methods")
+    parser.add_argument("--scopes", default=",".join(SCOPES),
+                        help="comma-separated port_scope values for the port and hybrid methods")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--churn", type=int, default=5,
+                        help="background processes replaced per iteration")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    monitor_path = args.monitor
+    if not os.path.exists(monitor_path):
+        monitor_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), args.monitor)
+    monitor_path = os.path.abspath(monitor_path)
+    output_path = os.path.abspath(args.output)
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+
+    module = load_monitor_module(monitor_path)
+
+    # Keep config/stats/status files of the monitor out of the working tree
+    os.chdir(tempfile.mkdtemp(prefix="netsupport_bench_"))
+
+    scopes = [s.strip() for s in args.scopes.split(",") if s.strip()]
+    scenarios = []
+    for method in [m.strip() for m in args.methods.split(",") if m.strip()]:
+        # Only the port check depends on the socket scope
+        for scope in (scopes if method in PORT_METHODS else scopes[:1]):
+            scenarios.append((method, scope))
+
+    results = []
+    for method, scope in scenarios:
+        for processes in args.processes:
+            for sockets in args.sockets:
+                for connected in (False, True):
+                    row = run_scenario(module, method, processes, sockets, connected,
+                                       args.iterations, args.churn, args.seed, scope)
+                    results.append(row)
+                    print(f"{method:<9} {scope:<6} {processes:>6}p {sockets:>7}s "
+                          f"{'connected' if connected else 'idle':<9} "
+                          f"p50 {row['p50_ms']:>9.3f} ms  p99 {row['p99_ms']:>9.3f} ms  "
+                          f"peak {row['peak_alloc_kb']:>9.1f} KiB  detected {row['detected']}")
+
+    report = {
+        "meta": {
+            "monitor": os.path.basename(monitor_path),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.time(),
+            "iterations": args.iterations,
+            "churn": args.churn,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {output_path}")
+
+    if compare_path:
+        compare(results, compare_path)
+
+
+if __name__ == "__main__":
+    main()
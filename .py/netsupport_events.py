@@ -0,0 +1,384 @@
+# netsupport_events.py - Process and config file event sources for the NetSupport tray monitors
+import ctypes
+import os
+import select
+import socket
+import struct
+import threading
+import time
+from typing import Callable, Optional, Set
+
+import psutil
+
+from netsupport_runtime import call_in_loop
+from netsupport_sockets import LINUX
+
+# linux/netlink.h, linux/connector.h, linux/cn_proc.h
+NETLINK_CONNECTOR = 11
+NLMSG_DONE = 3
+CN_IDX_PROC = 1
+CN_VAL_PROC = 1
+PROC_CN_MCAST_LISTEN = 1
+PROC_CN_MCAST_IGNORE = 2
+PROC_EVENT_EXEC = 0x00000002
+PROC_EVENT_EXIT = 0x80000000
+
+NLMSG_HEADER = struct.Struct("=IHHII")
+CN_MSG_HEADER = struct.Struct("=IIIIHH")
+PROC_EVENT_HEADER = struct.Struct("=IIQ")
+PROC_EVENT_PIDS = struct.Struct("=II")
+
+# sys/inotify.h
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct("=iIII")
+
+
+def build_mcast_message(op: int) -> bytes:
+    """Build the netlink message that (un)subscribes from proc events"""
+    payload = CN_MSG_HEADER.pack(CN_IDX_PROC, CN_VAL_PROC, 0, 0, 4, 0) + struct.pack("=I", op)
+    return NLMSG_HEADER.pack(NLMSG_HEADER.size + len(payload), NLMSG_DONE, 0, 0, os.getpid()) + payload
+
+
+def parse_proc_event(data: bytes):
+    """Return (what, pid, tgid) for one proc connector datagram, or None"""
+    offset = NLMSG_HEADER.size + CN_MSG_HEADER.size
+    if len(data) < offset + PROC_EVENT_HEADER.size + PROC_EVENT_PIDS.size:
+        return None
+    what, _, _ = PROC_EVENT_HEADER.unpack_from(data, offset)
+    pid, tgid = PROC_EVENT_PIDS.unpack_from(data, offset + PROC_EVENT_HEADER.size)
+    return what, pid, tgid
+
+
+class StopPipe:
+    """Self-pipe that wakes a thread blocked in select() once `set` is called"""
+
+    def __init__(self):
+        self.fd, self.write_fd = os.pipe()
+
+    def set(self):
+        try:
+            os.write(self.write_fd, b"\0")
+        except OSError:
+            pass
+
+    def close(self):
+        os.close(self.fd)
+        os.close(self.write_fd)
+
+
+class ProcessEventSource:
+    """Calls `on_event` as soon as a matching process starts or exits
+
+    On Linux this subscribes to the netlink proc connector (needs
+    CAP_NET_ADMIN). The socket is read from `loop` when one is passed to
+    `start`, otherwise from a thread that blocks until a datagram or `stop`
+    arrives. Without the connector `start` returns "proc_poll" and the
+    caller schedules `poll` every `poll_interval` seconds, which diffs the
+    PID directories in /proc. Other platforms have no event source and the
+    monitor keeps polling on its scan interval.
+    """
+
+    def __init__(self, match_name: Callable[[str], bool], on_event: Callable[[int, str], None],
+                 poll_interval: float = 0.5):
+        self.match_name = match_name
+        self.on_event = on_event
+        self.poll_interval = poll_interval
+        self.backend: Optional[str] = None
+        self.running = False
+        self.matched: Set[int] = set()
+        self.known: Set[int] = set()
+        self.sock = None
+        self.thread = None
+        self.loop = None
+        self.stop_pipe: Optional[StopPipe] = None
+
+    def start(self, loop=None) -> Optional[str]:
+        """Subscribe to process events; return the backend name or None"""
+        if not LINUX:
+            return None
+
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_CONNECTOR)
+            sock.bind((os.getpid(), CN_IDX_PROC))
+            sock.send(build_mcast_message(PROC_CN_MCAST_LISTEN))
+        except OSError as e:
+            print(f"Proc connector unavailable, watching /proc: {e}")
+            self.backend = "proc_poll"
+            self.known = self.list_pids()
+            self.running = True
+            return self.backend
+
+        self.sock = sock
+        self.backend = "proc_connector"
+        self.running = True
+        if loop is not None:
+            sock.setblocking(False)
+            self.loop = loop
+            loop.add_reader(sock.fileno(), self.on_readable)
+        else:
+            self.stop_pipe = StopPipe()
+            self.thread = threading.Thread(target=self.connector_loop, daemon=True)
+            self.thread.start()
+        return self.backend
+
+    def stop(self):
+        """Unsubscribe and release the socket"""
+        self.running = False
+        if self.sock is not None:
+            try:
+                self.sock.send(build_mcast_message(PROC_CN_MCAST_IGNORE))
+            except OSError:
+                pass
+        if self.loop is not None:
+            call_in_loop(self.loop, self.close)
+            return
+        if self.stop_pipe is not None:
+            self.stop_pipe.set()
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout=2)
+        self.close()
+
+    def close(self):
+        """Close the socket and stop pipe"""
+        if self.sock is not None:
+            if self.loop is not None:
+                self.loop.remove_reader(self.sock.fileno())
+            self.sock.close()
+            self.sock = None
+        if self.stop_pipe is not None:
+            self.stop_pipe.close()
+            self.stop_pipe = None
+
+    def process_name(self, pid: int) -> Optional[str]:
+        """Lowercase name of a freshly started process"""
+        try:
+            return psutil.Process(pid).name().lower()
+        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+            return None
+
+    def handle_exec(self, pid: int):
+        """Report a started process if it matches a signature"""
+        name = self.process_name(pid)
+        if name and self.match_name(name):
+            self.matched.add(pid)
+            self.on_event(pid, name)
+
+    def handle_exit(self, pid: int):
+        """Report the exit of a previously matched process"""
+        if pid in self.matched:
+            self.matched.discard(pid)
+            self.on_event(pid, "")
+
+    def dispatch(self, data: bytes):
+        """Handle one proc connector datagram"""
+        event = parse_proc_event(data)
+        if event is None:
+            return
+        what, pid, tgid = event
+        try:
+            if what == PROC_EVENT_EXEC:
+                self.handle_exec(tgid)
+            elif what == PROC_EVENT_EXIT and pid == tgid:
+                # Thread exits share the tgid; only the leader ends the process
+                self.handle_exit(tgid)
+        except Exception as e:
+            print(f"Process event error: {e}")
+
+    def connector_loop(self):
+        """Receive exec/exit events from the kernel until `stop`"""
+        while self.running:
+            readable, _, _ = select.select([self.sock, self.stop_pipe.fd], [], [])
+            if self.stop_pipe.fd in readable:
+                break
+            try:
+                data = self.sock.recv(4096)
+            except OSError as e:
+                if self.running:
+                    print(f"Proc connector error: {e}")
+                break
+            self.dispatch(data)
+
+    def on_readable(self):
+        """Event loop callback: drain the pending datagrams"""
+        while self.sock is not None:
+            try:
+                data = self.sock.recv(4096)
+            except BlockingIOError:
+                return
+            except OSError as e:
+                print(f"Proc connector error: {e}")
+                self.loop.remove_reader(self.sock.fileno())
+                return
+            self.dispatch(data)
+
+    def list_pids(self) -> Set[int]:
+        """PIDs currently present in /proc"""
+        return {int(entry) for entry in os.listdir("/proc") if entry.isdigit()}
+
+    def poll(self):
+        """Fallback, scheduled by the caller: diff the PID directories in /proc"""
+        if not self.running:
+            return
+        try:
+            current = self.list_pids()
+            for pid in current - self.known:
+                self.handle_exec(pid)
+            for pid in self.matched - current:
+                self.handle_exit(pid)
+            self.known = current
+        except Exception as e:
+            print(f"Process watch error: {e}")
+
+
+def file_signature(path: str) -> Optional[tuple]:
+    """Inode, modification time and size of a file, None if it is missing"""
+    try:
+        stat = os.stat(path)
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
+
+
+def parse_inotify_names(data: bytes) -> Set[str]:
+    """File names of all events in one inotify read"""
+    names = set()
+    offset = 0
+    while offset + INOTIFY_EVENT.size <= len(data):
+        _, _, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+        offset += INOTIFY_EVENT.size
+        names.add(data[offset:offset + length].split(b"\0", 1)[0].decode("utf-8", "replace"))
+        offset += length
+    return names
+
+
+class ConfigWatcher:
+    """Calls `on_change` shortly after a file is written, replaced or removed
+
+    On Linux the file's directory is watched with inotify, since editors and
+    os.replace swap the inode and a watch on the file itself would go stale.
+    Bursts of events from one save are coalesced into a single call. The
+    inotify fd is read from `loop` when one is passed to `start`, otherwise
+    from a thread that blocks until an event or `stop` arrives. On other
+    platforms, or when inotify is unavailable, `start` returns None and the
+    caller keeps polling `file_signature`.
+    """
+
+    def __init__(self, path: str, on_change: Callable[[], None], settle: float = 0.02):
+        self.path = os.path.abspath(path)
+        self.on_change = on_change
+        self.settle = settle
+        self.backend: Optional[str] = None
+        self.running = False
+        self.fd: Optional[int] = None
+        self.thread = None
+        self.loop = None
+        self.pending = None
+        self.stop_pipe: Optional[StopPipe] = None
+
+    def start(self, loop=None) -> Optional[str]:
+        """Start watching; return the backend name or None"""
+        if not LINUX:
+            return None
+
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+            mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+            if libc.inotify_add_watch(fd, os.path.dirname(self.path).encode(), mask) < 0:
+                error = ctypes.get_errno()
+                os.close(fd)
+                raise OSError(error, "inotify_add_watch failed")
+        except (OSError, AttributeError) as e:
+            print(f"inotify unavailable, polling config file: {e}")
+            return None
+
+        self.fd = fd
+        self.backend = "inotify"
+        self.running = True
+        if loop is not None:
+            self.loop = loop
+            loop.add_reader(fd, self.on_readable)
+        else:
+            self.stop_pipe = StopPipe()
+            self.thread = threading.Thread(target=self.watch_loop, daemon=True)
+            self.thread.start()
+        return self.backend
+
+    def stop(self):
+        """Stop watching and close the inotify fd"""
+        self.running = False
+        if self.loop is not None:
+            call_in_loop(self.loop, self.close)
+            return
+        if self.stop_pipe is not None:
+            self.stop_pipe.set()
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout=2)
+        self.close()
+
+    def close(self):
+        """Close the inotify fd and stop pipe"""
+        if self.pending is not None:
+            self.pending.cancel()
+            self.pending = None
+        if self.fd is not None:
+            if self.loop is not None:
+                self.loop.remove_reader(self.fd)
+            os.close(self.fd)
+            self.fd = None
+        if self.stop_pipe is not None:
+            self.stop_pipe.close()
+            self.stop_pipe = None
+
+    def read_names(self, timeout: Optional[float] = None) -> Set[str]:
+        """Wait for events (up to `timeout` seconds, None = until `stop`) and return the touched names"""
+        readable, _, _ = select.select([self.fd, self.stop_pipe.fd], [], [], timeout)
+        if self.fd not in readable:
+            return set()
+        try:
+            return parse_inotify_names(os.read(self.fd, 4096))
+        except BlockingIOError:
+            return set()
+
+    def watch_loop(self):
+        """Report changes of the watched file"""
+        name = os.path.basename(self.path)
+        while self.running:
+            try:
+                if name not in self.read_names():
+                    continue
+                # Let the rest of the save (truncate, write, rename) land first
+                while self.read_names(self.settle):
+                    pass
+                if self.running:
+                    self.on_change()
+            except Exception as e:
+                if self.running:
+                    print(f"Config watch error: {e}")
+                    time.sleep(1)
+
+    def on_readable(self):
+        """Event loop callback: every event of a save pushes the call back by `settle`"""
+        try:
+            names = parse_inotify_names(os.read(self.fd, 4096))
+        except BlockingIOError:
+            return
+        if os.path.basename(self.path) in names or self.pending is not None:
+            if self.pending is not None:
+                self.pending.cancel()
+            self.pending = self.loop.call_later(self.settle, self.fire)
+
+    def fire(self):
+        """Event loop callback: the save has settled"""
+        self.pending = None
+        try:
+            self.on_change()
+        except Exception as e:
+            print(f"Config watch error: {e}")
@@ -0,0 +1,207 @@
+# netsupport_fakeps.py - Synthetic psutil backend for benchmarks and replays
+import importlib.util
+import random
+import socket
+import sys
+import types
+from collections import namedtuple
+from typing import Dict, List, Optional
+
+import psutil
+
+from netsupport_sockets import Addr, Connection
+
+Snicaddr = namedtuple("Snicaddr", ["family", "address", "netmask", "broadcast", "ptp"])
+Snicstats = namedtuple("Snicstats", ["isup", "duplex", "speed", "mtu", "flags"])
+
+BACKGROUND_NAMES = (
+    "svchost.exe", "explorer.exe", "chrome.exe", "msedge.exe", "teams.exe",
+    "onedrive.exe", "runtimebroker.exe", "searchhost.exe", "python.exe",
+    "conhost.exe", "dllhost.exe", "wmiprvse.exe", "spoolsv.exe", "lsass.exe"
+)
+
+# Modules that reference psutil at call time and get the fake swapped in
+PATCHED_MODULES = ("netsupport_probes", "netsupport_sockets", "netsupport_events")
+
+
+class FakeProcess:
+    """Stand-in for psutil.Process backed by a FakePsutil table"""
+
+    def __init__(self, backend: "FakePsutil", pid: int):
+        entry = backend.processes.get(pid)
+        if entry is None:
+            raise psutil.NoSuchProcess(pid)
+        self.backend = backend
+        self.pid = pid
+        self._create_time = entry["create_time"]
+
+    def _entry(self) -> dict:
+        entry = self.backend.processes.get(self.pid)
+        if entry is None or entry["create_time"] != self._create_time:
+            raise psutil.NoSuchProcess(self.pid)
+        return entry
+
+    def name(self) -> str:
+        return self._entry()["name"]
+
+    def exe(self) -> str:
+        return self._entry()["exe"]
+
+    def cmdline(self) -> List[str]:
+        return list(self._entry()["cmdline"])
+
+    def create_time(self) -> float:
+        return self._create_time
+
+    def is_running(self) -> bool:
+        entry = self.backend.processes.get(self.pid)
+        return entry is not None and entry["create_time"] == self._create_time
+
+    def net_connections(self, kind: str = "inet") -> list:
+        self._entry()
+        return list(self.backend.sockets_by_pid.get(self.pid, ()))
+
+    connections = net_connections
+
+
+class FakePsutil:
+    """Synthetic process and socket tables exposed through the psutil API
+
+    Only the calls the monitor makes are implemented. Exceptions are the real
+    psutil classes so `except psutil.NoSuchProcess` keeps working.
+    """
+
+    NoSuchProcess = psutil.NoSuchProcess
+    AccessDenied = psutil.AccessDenied
+    ZombieProcess = psutil.ZombieProcess
+
+    def __init__(self, seed: int = 0):
+        self.random = random.Random(seed)
+        self.processes: Dict[int, dict] = {}
+        self.sockets_by_pid: Dict[Optional[int], List[Connection]] = {}
+        self.interfaces = {
+            "lo": [Snicaddr(socket.AF_INET, "127.0.0.1", "255.0.0.0", None, None),
+                   Snicaddr(socket.AF_INET6, "::1", None, None, None)],
+            "eth0": [Snicaddr(socket.AF_INET, "10.0.0.2", "255.255.255.0", None, None),
+                     Snicaddr(socket.AF_INET6, "fe80::2%eth0", None, None, None)],
+        }
+        self.next_pid = 4
+        self.clock = 1_000_000.0
+
+    # --- table builders -------------------------------------------------
+
+    def add_process(self, name: str, exe: Optional[str] = None,
+                    cmdline: Optional[List[str]] = None, pid: Optional[int] = None,
+                    create_time: Optional[float] = None) -> int:
+        """Add a process and return its PID"""
+        if pid is None:
+            pid = self.next_pid
+            self.next_pid += 4
+        if create_time is None:
+            self.clock += 0.01
+            create_time = self.clock
+        self.processes[pid] = {
+            "name": name,
+            "exe": exe or f"C:\\Windows\\System32\\{name}",
+            "cmdline": cmdline or [name],
+            "create_time": create_time,
+        }
+        return pid
+
+    def remove_process(self, pid: int):
+        """Remove a process and its sockets"""
+        self.processes.pop(pid, None)
+        self.sockets_by_pid.pop(pid, None)
+
+    def add_connection(self, pid: Optional[int], lport: int, rport: int,
+                       status: str = "ESTABLISHED", lip: str = "10.0.0.2",
+                       rip: str = "10.0.0.1", family: int = socket.AF_INET) -> Connection:
+        """Add a socket owned by `pid`"""
+        conn = Connection(-1, family, socket.SOCK_STREAM, Addr(lip, lport),
+                          Addr(rip, rport) if rport else (), status, pid)
+        self.sockets_by_pid.setdefault(pid, []).append(conn)
+        return conn
+
+    def populate(self, processes: int, sockets: int, connected: bool = False, port: int = 5405):
+        """Fill the tables with background load and optionally a NetSupport session"""
+        pids = [self.add_process(self.random.choice(BACKGROUND_NAMES)) for _ in range(processes)]
+        statuses = ("ESTABLISHED", "TIME_WAIT", "LISTEN", "CLOSE_WAIT")
+        for _ in range(sockets):
+            self.add_connection(self.random.choice(pids), self.random.randint(1024, 65000),
+                                self.random.choice((80, 443, 445, 3389)),
+                                self.random.choice(statuses))
+
+        client = self.add_process("client32.exe", "C:\\Program Files\\NetSupport\\client32.exe")
+        self.add_connection(client, port, 0, "LISTEN", "0.0.0.0")
+        if connected:
+            self.add_connection(client, port, 51234)
+
+    def churn(self, count: int):
+        """Replace `count` background processes, as a busy desktop would"""
+        background = [pid for pid, entry in self.processes.items()
+                      if entry["name"] in BACKGROUND_NAMES]
+        for pid in self.random.sample(background, min(count, len(background))):
+            self.remove_process(pid)
+            self.add_process(self.random.choice(BACKGROUND_NAMES))
+
+    # --- psutil API -----------------------------------------------------
+
+    def pids(self) -> List[int]:
+        return list(self.processes)
+
+    def Process(self, pid: int) -> FakeProcess:
+        return FakeProcess(self, pid)
+
+    def process_iter(self, attrs=None, ad_value=None):
+        for pid in list(self.processes):
+            try:
+                proc = FakeProcess(self, pid)
+            except psutil.NoSuchProcess:
+                continue
+            proc.info = {"pid": pid, "name": proc.name()}
+            yield proc
+
+    def net_connections(self, kind: str = "inet") -> list:
+        # psutil materializes the whole table on every call
+        return [conn for conns in self.sockets_by_pid.values() for conn in conns]
+
+    def net_if_addrs(self) -> Dict[str, list]:
+        return {name: list(addrs) for name, addrs in self.interfaces.items()}
+
+    def net_if_stats(self) -> Dict[str, Snicstats]:
+        return {name: Snicstats(True, 2, 1000, 1500, "up") for name in self.interfaces}
+
+
+def load_monitor_module(path: str):
+    """Import a monitor script by path without starting its tray"""
+    try:
+        import pystray  # noqa: F401
+    except Exception:
+        # No display or pystray missing: the tray is never started here
+        sys.modules["pystray"] = types.ModuleType("pystray")
+
+    spec = importlib.util.spec_from_file_location("netsupport_monitor", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def install(backend, monitor_module=None):
+    """Point the helper modules (and optionally a monitor module) at `backend`
+
+    Returns the previous psutil references so `uninstall` can restore them.
+    """
+    previous = {}
+    modules = [sys.modules[name] for name in PATCHED_MODULES if name in sys.modules]
+    if monitor_module is not None:
+        modules.append(monitor_module)
+    for module in modules:
+        previous[module] = module.psutil
+        module.psutil = backend
+    return previous
+
+
+def uninstall(previous):
+    """Restore the psutil references returned by `install`"""
+    for module, original in previous.items():
+        module.psutil = original
@@ -0,0 +1,106 @@
+# netsupport_history.py - SQLite session history for the NetSupport tray monitors
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    start REAL NOT NULL,
+    end REAL,
+    duration REAL,
+    probe TEXT,
+    peer TEXT
+);
+CREATE INDEX IF NOT EXISTS sessions_start ON sessions (start);
+"""
+
+COLUMNS = ("start", "end", "duration", "probe", "peer")
+
+
+class HistoryStore:
+    """Complete connection sessions in an embedded SQLite database
+
+    A session is kept in memory while it is open and queued as one row when
+    it ends; queued rows are written in a single transaction once
+    `batch_size` of them are waiting or `flush` is called. The database runs
+    in WAL mode so readers never block the monitor, and `sessions`/`count`
+    only touch the requested time range through the index on `start`.
+    A session still open at `close` is written with `end` and `duration`
+    NULL: the monitor stopped watching, the session did not end.
+    """
+
+    def __init__(self, path: str, batch_size: int = 20):
+        self.path = path
+        self.batch_size = max(1, int(batch_size))
+        self.pending: List[Tuple] = []
+        self.current: Optional[Dict[str, Any]] = None
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+
+    def start(self, start: float, probe: Optional[str] = None, peer: Optional[str] = None):
+        """Open a session"""
+        with self._lock:
+            self.current = {"start": start, "end": None, "duration": None,
+                            "probe": probe, "peer": peer}
+
+    def end(self, end: float) -> bool:
+        """Close the open session; True when a batch is ready to be flushed"""
+        with self._lock:
+            if self.current is None:
+                return False
+            session = self.current
+            self.current = None
+            self.pending.append((session["start"], end, max(0.0, end - session["start"]),
+                                 session["probe"], session["peer"]))
+            return len(self.pending) >= self.batch_size
+
+    def _flush(self):
+        if self.pending:
+            with self.db:
+                self.db.executemany(
+                    "INSERT INTO sessions (start, end, duration, probe, peer) VALUES (?, ?, ?, ?, ?)",
+                    self.pending)
+            self.pending = []
+
+    def flush(self):
+        """Write queued sessions in one transaction"""
+        with self._lock:
+            self._flush()
+
+    def sessions(self, start: float, end: float, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Sessions that started in [start, end), oldest first, including an open one"""
+        with self._lock:
+            self._flush()
+            query = "SELECT start, end, duration, probe, peer FROM sessions WHERE start >= ? AND start < ? ORDER BY start"
+            params: Tuple = (start, end)
+            if limit is not None:
+                query = f"SELECT * FROM ({query} DESC LIMIT ?) ORDER BY start"
+                params += (int(limit),)
+            rows = [dict(zip(COLUMNS, row)) for row in self.db.execute(query, params)]
+            if self.current is not None and start <= self.current["start"] < end:
+                rows.append(dict(self.current))
+            return rows
+
+    def count(self, start: float, end: float) -> int:
+        """Number of sessions that started in [start, end)"""
+        with self._lock:
+            self._flush()
+            (total,) = self.db.execute("SELECT COUNT(*) FROM sessions WHERE start >= ? AND start < ?",
+                                       (start, end)).fetchone()
+            if self.current is not None and start <= self.current["start"] < end:
+                total += 1
+            return total
+
+    def close(self):
+        """Flush queued sessions, including an open one, and close the database"""
+        with self._lock:
+            if self.current is not None:
+                session = self.current
+                self.current = None
+                self.pending.append(tuple(session[column] for column in COLUMNS))
+            self._flush()
+            self.db.close()
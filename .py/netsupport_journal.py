@@ -0,0 +1,176 @@
+# netsupport_journal.py - Append-only connection event journal for the NetSupport tray monitors
+import json
+import os
+import threading
+import zlib
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from netsupport_ring import DEFAULT_CAPACITY, HistoryRing
+from netsupport_rollups import COUNT, add_connection, add_sample, add_session, lookup
+from netsupport_sketch import add, new_sketch
+
+
+def apply_event(stats: Dict[str, Any], event: Dict[str, Any]):
+    """Apply one connect/disconnect event to the statistics dict"""
+    timestamp = event["t"]
+    history = stats.get("connection_history")
+    if not isinstance(history, HistoryRing):
+        history = stats["connection_history"] = HistoryRing.load(history)
+    rollups = stats.setdefault("rollups", {})
+    sketches = stats.setdefault("sketches", {})
+    if event["e"] == "connect":
+        add_connection(rollups, timestamp)
+        if stats.get("last_connection_time"):
+            gap = timestamp - stats["last_connection_time"]
+            add(sketches.setdefault("interarrival", new_sketch()), gap)
+            add_sample(rollups, "interarrival", timestamp, gap)
+        stats["total_connections"] = stats.get("total_connections", 0) + 1
+        # Read from the day bucket, so the count rolls over at midnight
+        stats["connections_today"] = lookup(rollups, "day", timestamp)[COUNT]
+        stats["last_reset"] = datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d")
+        stats["last_connection_time"] = timestamp
+        history.append(timestamp)
+    elif event["e"] == "disconnect":
+        if stats.get("last_connection_time"):
+            duration = timestamp - stats["last_connection_time"]
+            stats["total_connection_duration"] = stats.get("total_connection_duration", 0) + duration
+            add_session(rollups, stats["last_connection_time"], duration)
+            add(sketches.setdefault("duration", new_sketch()), duration)
+            add_sample(rollups, "duration", stats["last_connection_time"], duration)
+            history.end_last(duration)
+
+
+def encode_record(event: Dict[str, Any]) -> bytes:
+    """One journal line: CRC32 of the JSON payload, a space, the payload"""
+    payload = json.dumps(event, separators=(",", ":")).encode("utf-8")
+    return b"%08x %s\n" % (zlib.crc32(payload), payload)
+
+
+def decode_record(line: bytes) -> Optional[Dict[str, Any]]:
+    """Parse a journal line, None if it is torn or its checksum is wrong"""
+    if not line.endswith(b"\n") or len(line) < 10 or line[8:9] != b" ":
+        return None
+    payload = line[9:-1]
+    try:
+        if int(line[:8], 16) != zlib.crc32(payload):
+            return None
+        return json.loads(payload)
+    except ValueError:
+        return None
+
+
+class StatsJournal:
+    """Connection statistics kept as a snapshot file plus an append-only journal
+
+    Every event is one checksummed line appended to the journal, so the cost
+    of recording it does not depend on the size of the history. `compact`
+    folds the journal into the snapshot (written atomically) and empties
+    it. `recover` loads the snapshot and replays the journal records newer
+    than the snapshot's `journal_seq`, cutting off a torn tail left by a
+    crash.
+    """
+
+    def __init__(self, snapshot_path: str, journal_path: str, compact_every: int = 100,
+                 history_capacity: int = DEFAULT_CAPACITY):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.compact_every = max(1, int(compact_every))
+        self.history_capacity = max(1, int(history_capacity))
+        self.seq = 0
+        self.pending = 0
+        self.file = None
+        self._lock = threading.Lock()
+
+    def read_journal(self) -> Tuple[List[Dict[str, Any]], int]:
+        """Return the valid journal records and the byte length they cover"""
+        records = []
+        valid_length = 0
+        try:
+            with open(self.journal_path, "rb") as f:
+                for line in f:
+                    record = decode_record(line)
+                    if record is None:
+                        break
+                    records.append(record)
+                    valid_length += len(line)
+        except FileNotFoundError:
+            pass
+        return records, valid_length
+
+    def recover(self) -> Dict[str, Any]:
+        """Load the snapshot and replay the journal tail; return the statistics"""
+        stats: Dict[str, Any] = {}
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                stats = json.load(f)
+        snapshot_seq = int(stats.pop("journal_seq", 0))
+        stats["connection_history"] = HistoryRing.load(stats.get("connection_history"),
+                                                       self.history_capacity)
+
+        records, valid_length = self.read_journal()
+        if os.path.exists(self.journal_path) and os.path.getsize(self.journal_path) > valid_length:
+            print(f"Stats journal: dropping torn tail after {len(records)} records")
+            os.truncate(self.journal_path, valid_length)
+
+        self.seq = snapshot_seq
+        self.pending = 0
+        for record in records:
+            if record.get("seq", 0) <= snapshot_seq:
+                # Already folded into the snapshot by an interrupted compaction
+                continue
+            apply_event(stats, record)
+            self.seq = record["seq"]
+            self.pending += 1
+        return stats
+
+    def append(self, stats: Dict[str, Any], event: Dict[str, Any]) -> bool:
+        """Apply `event` to `stats` and journal it; True when compaction is due"""
+        with self._lock:
+            self.seq += 1
+            event = {"seq": self.seq, **event}
+            apply_event(stats, event)
+
+            if self.file is None:
+                self.file = open(self.journal_path, "ab")
+            self.file.write(encode_record(event))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.pending += 1
+            return self.pending >= self.compact_every
+
+    def compact(self, stats: Dict[str, Any]):
+        """Write `stats` as the new snapshot and empty the journal"""
+        with self._lock:
+            data = json.dumps({**stats, "journal_seq": self.seq}, separators=(",", ":"),
+                              default=lambda value: value.to_json())
+            tmp_path = f"{self.snapshot_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.snapshot_path)
+
+            # A crash before this truncate is harmless: recover skips seq <= journal_seq
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            if os.path.exists(self.journal_path):
+                os.truncate(self.journal_path, 0)
+            self.pending = 0
+
+    def resize_history(self, stats: Dict[str, Any], capacity: int):
+        """Change the connection history capacity, keeping the newest records"""
+        with self._lock:
+            self.history_capacity = max(1, int(capacity))
+            history = stats.get("connection_history")
+            if isinstance(history, HistoryRing):
+                history = history.to_json()
+            stats["connection_history"] = HistoryRing.load(history, self.history_capacity)
+
+    def close(self):
+        """Close the journal file"""
+        with self._lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
@@ -7,8 +7,7 @@ import time
 import queue
 import subprocess
 from datetime import datetime
-from functools import lru_cache
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Set
 
 try:
     import psutil
@@ -25,6 +24,20 @@ except Exception as e:
     print("Install: python -m pip install psutil pillow pystray")
     sys.exit(1)
 
+from netsupport_rollups import COUNT, lookup, merged_sketch
+from netsupport_sketch import quantile
+from netsupport_probes import (DetectionScheduler, ProcessScanner, SignatureIndex,
+                               SnapshotCache, parse_detection_method)
+from netsupport_sockets import (LINUX, AdapterAddressCache, LinuxPortProbe,
+                                PidConnectionProbe)
+from netsupport_events import ConfigWatcher, ProcessEventSource, file_signature
+from netsupport_history import HistoryStore
+from netsupport_journal import StatsJournal
+from netsupport_runtime import (AdaptiveScanScheduler, AsyncRuntime, ConnectionStateMachine,
+                                DeadlineScheduler)
+from netsupport_status import (StatusPublisher, StatusRecord, StatusServer,
+                               default_status_address)
+
 class SimpleCMDInterface:
     def __init__(self, monitor):
         self.monitor = monitor
@@ -50,6 +63,12 @@ import os
 import sys
 from datetime import datetime
 
+def method_label(value):
+    """Detection method as text; config.json may also hold a list"""
+    if isinstance(value, (list, tuple)):
+        return "+".join(str(v) for v in value)
+    return str(value)
+
 def load_config():
     """Load configuration with improved error handling"""
     default_config = {
@@ -75,16 +94,35 @@ def load_config():
         print(f"Error loading config: {e}")
         return default_config
 
+status_cache = {"seq": None, "status": None}
+
+try:
+    from netsupport_status import StatusRecordReader
+    status_record = StatusRecordReader(STATUS_RECORD, STATUS_RECORD_MAX_AGE) if STATUS_RECORD else None
+except Exception:
+    status_record = None
+
 def load_status():
-    """Load real-time status from shared status file"""
+    """Load real-time status: shared-memory record first, status file as fallback"""
     default_status = {"connected": False, "last_check": None, "method_used": "unknown"}
+    if status_record is not None:
+        record = status_record.read()
+        if record is not None:
+            return record
     try:
         if not os.path.exists("netsupport_status.json"):
             return default_status
         with open("netsupport_status.json", "r", encoding="utf-8") as f:
-            loaded = json.load(f)
-            return {**default_status, **loaded}
-    except json.JSONDecodeError:
+            data = f.read()
+        seq = None
+        if data.startswith('{"seq":'):
+            seq = int(data[7:data.index(",", 7)])
+            if seq == status_cache["seq"]:
+                return status_cache["status"]
+        status = {**default_status, **json.loads(data)}
+        status_cache["seq"], status_cache["status"] = seq, status
+        return status
+    except (json.JSONDecodeError, ValueError):
         return default_status
     except Exception:
         return default_status
@@ -118,7 +156,7 @@ def show_main_screen():
     print(f"| Status: {get_status():<42} |")
     print("|                                                    |")
     print(f"| Laatste check: {get_last_check():<34} |")
-    print(f"| Method: {config.get('detection_method', 'process'):<41} |")
+    print(f"| Method: {method_label(config.get('detection_method', 'process')):<41} |")
     print(f"| Scan interval: {config.get('scan_interval', 2)} seconden{' '*(29)} |")
     print("|                                                    |")
     logging_status = "Aan" if config.get('logging', False) else "Uit"
@@ -142,7 +180,7 @@ def show_settings():
         print("|                   INSTELLINGEN                     |")
         print("+======================================================+")
         print("|                                                    |")
-        print(f"| 1) Detection Method: {config.get('detection_method', 'process'):<26} |")
+        print(f"| 1) Detection Method: {method_label(config.get('detection_method', 'process')):<26} |")
         print(f"| 2) Scan Interval: {config.get('scan_interval', 2)} seconden{' '*(21)} |")
         logging_status = "Aan" if config.get('logging', False) else "Uit"
         print(f"| 3) Logging: {logging_status:<37} |")
@@ -262,6 +300,16 @@ if __name__ == "__main__":
     main()
 '''
 
+        # Let the script import the shared-memory status reader next to this file
+        # and read the record the monitor is configured to write
+        module_dir = os.path.dirname(os.path.abspath(__file__))
+        record_path = self.monitor.config.get("status_record", "netsupport_status.shm")
+        record_path = os.path.abspath(record_path) if record_path else ""
+        script_content = (f"import sys\nsys.path.insert(0, {module_dir!r})\n"
+                          f"STATUS_RECORD = {record_path!r}\n"
+                          f"STATUS_RECORD_MAX_AGE = {self.monitor.status_record_max_age()!r}\n"
+                          + script_content)
+
         # Write Python script
         script_path = "netsupport_details.py"
         try:
@@ -340,6 +388,12 @@ import sys
 import time
 from datetime import datetime
 
+def method_label(value):
+    """Detection method as text; config.json may also hold a list"""
+    if isinstance(value, (list, tuple)):
+        return "+".join(str(v) for v in value)
+    return str(value)
+
 def load_config():
     default_config = {
         "detection_method": "process",
@@ -380,7 +434,7 @@ def show_settings():
         print("|                     SETTINGS                       |")
         print("+======================================================+")
         print("|                                                    |")
-        print(f"| 1) Detection Method: {config.get('detection_method', 'process'):<26} |")
+        print(f"| 1) Detection Method: {method_label(config.get('detection_method', 'process')):<26} |")
         print(f"| 2) Scan Interval: {config.get('scan_interval', 2)} seconds{' '*(24)} |")
         logging_status = "On" if config.get('logging', False) else "Off"
         print(f"| 3) Logging: {logging_status:<37} |")
@@ -493,9 +547,38 @@ python "{script_path_escaped}"
         # Format statistics with validation and sanitization
         total = int(stats.get('total_connections', 0))
         today = int(stats.get('connections_today', 0))
+        week = today
+        if stats.get('rollups'):
+            # Precomputed buckets; the day bucket also covers a midnight rollover
+            now = time.time()
+            today = int(lookup(stats['rollups'], "day", now)[COUNT])
+            week = int(lookup(stats['rollups'], "week", now)[COUNT])
         duration = float(stats.get('total_connection_duration', 0)) / 60
         last_conn = stats.get('last_connection_time')
+
+        # Quantiles of the last 30 days, merged from the daily sketches, in minutes
+        def percentiles(name):
+            if name in stats.get('rollups', {}).get('sketches', {}):
+                now = time.time()
+                sketch = merged_sketch(stats['rollups'], name, now - 30 * 86400, now)
+            else:
+                # Snapshots from before the daily sketches only have the cumulative one
+                sketch = stats.get('sketches', {}).get(name)
+            values = [quantile(sketch, q) for q in (0.5, 0.9, 0.99)] if sketch else []
+            if not values or values[0] is None:
+                return "-"
+            return "/".join(f"{v / 60:.1f}" for v in values) + " min"
+
+        session_pct = percentiles("duration")
+        gap_pct = percentiles("interarrival")
         history_count = len(stats.get('connection_history', []))
+        if self.monitor.history_store:
+            # Sessions of the last 30 days, counted through the start-time index
+            try:
+                now = time.time()
+                history_count = self.monitor.history_store.count(now - 30 * 86400, now + 1)
+            except Exception as e:
+                print(f"History store error: {e}")
 
         # Validate and format timestamp safely
         if last_conn:
@@ -516,6 +599,9 @@ python "{script_path_escaped}"
 
         total_safe = sanitize(total)
         today_safe = sanitize(today)
+        week_safe = sanitize(week)
+        session_safe = sanitize(session_pct)
+        gap_safe = sanitize(gap_pct)
         duration_safe = sanitize(f"{duration:.1f}")
         last_conn_safe = sanitize(last_conn_str)
         history_safe = sanitize(history_count)
@@ -527,10 +613,13 @@ import sys
 
 def show_stats():
     os.system("cls")
-    os.system("mode con: cols=58 lines=18")
+    os.system("mode con: cols=58 lines=21")
 
     total = "{total_safe}"
     today = "{today_safe}"
+    week = "{week_safe}"
+    session_pct = "{session_safe}"
+    gap_pct = "{gap_safe}"
     duration_str = "{duration_safe}"
     last_conn = "{last_conn_safe}"
     history = "{history_safe}"
@@ -541,7 +630,10 @@ def show_stats():
     print("|                                                    |")
     print(f"| Total connections:     {{total:<27}} |")
     print(f"| Connections today:     {{today:<27}} |")
+    print(f"| Connections this week: {{week:<27}} |")
     print(f"| Total duration:        {{duration_str}} minutes{{' '*(27-len(duration_str)-8)}} |")
+    print(f"| Session p50/p90/p99:   {{session_pct:<27}} |")
+    print(f"| Gap p50/p90/p99:       {{gap_pct:<27}} |")
     print("|                                                    |")
     print(f"| Last connection:                                   |")
     print(f"|   {{last_conn:<50}} |")
@@ -588,7 +680,7 @@ if __name__ == "__main__":
             batch_script = f'''@echo off
 title NetSupport Monitor - Statistics
 color 0A
-mode con: cols=58 lines=18
+mode con: cols=58 lines=21
 
 python "{script_path_escaped}"
 '''
@@ -610,6 +702,7 @@ class NetSupportMonitorSimple:
         self.translations_file = "translations.json"
         self.running = False
         self.log_buffer = []
+        self.log_lock = threading.Lock()
         self.last_flush = time.time()
 
         # Load configuration
@@ -627,13 +720,86 @@ class NetSupportMonitorSimple:
         # Status tracking
         self.last_status = None
         self.last_check_time = None
-
-        # Statistics tracking
+        self.status_publisher = StatusPublisher(self.status_file,
+                                                self.config.get("status_heartbeat", 10))
+        self.status_record = self.create_status_record()
+        self.status_server = None
+
+        # Debounced SAFE/SUSPECT/CONNECTED/DRAINING state
+        self.connection_state = ConnectionStateMachine(
+            self.config.get("connect_confirmations", 1),
+            self.config.get("disconnect_confirmations", 2)
+        )
+
+        # Statistics tracking: snapshot + append-only event journal
+        self.stats_journal = StatsJournal(self.stats_file,
+                                          self.config.get("stats_journal", "netsupport_stats.journal"),
+                                          self.config.get("stats_compact_every", 100),
+                                          self.config.get("history_capacity", 1000))
         self.stats = self.load_stats()
+        self.history_store = self.create_history_store()
+        self.last_peer = None
+
+        # Incremental process scanner (only inspects new PIDs)
+        self.process_scanner = ProcessScanner(SignatureIndex.from_config(self.config))
+
+        # Probe snapshots shared by all detectors within one tick
+        self.snapshot_cache = SnapshotCache(self.config.get("cache_ttl", 1.0))
+
+        # Detectors selected by detection_method, ordered by cost per detection
+        self.detection = self.build_detection()
+
+        # Kernel-filtered port probe on Linux (created on first use)
+        self.linux_port_probe = None
+
+        # Port probe scoped to known NetSupport PIDs
+        self.pid_port_probe = PidConnectionProbe(self.config.get("cache_ttl", 1.0),
+                                                 self.config.get("port_full_scan_interval", 30))
+
+        # Adapter address sets, rebuilt only when the interfaces change
+        self.adapter_cache = AdapterAddressCache(self.config.get("adapter_refresh_interval", 10))
+
+        # Process exec/exit events wake the monitor thread immediately
+        self.wake_event = threading.Event()
+        # Config changes are applied between connection checks, never during one
+        self.detection_lock = threading.Lock()
+        self.event_source = None
+
+        # Idle backoff with jitter; weak signals snap back to scan_interval
+        self.scan_scheduler = AdaptiveScanScheduler(
+            self.config.get("scan_interval", 2),
+            self.idle_scan_ceiling(),
+            self.config.get("scan_backoff", 2.0),
+            self.config.get("scan_jitter", 0.1)
+        )
+        self.signal_pids = frozenset()
+        self.signal_listener = False
+
+        # Optional snapshot recording for offline replays
+        self.recorder = self.create_recorder()
+
+        # Probe, config reload, heartbeat and log flush share one deadline heap
+        self.jobs = DeadlineScheduler(self.wake_event)
+        self.async_runtime = None
+        self.config_signature = file_signature(self.config_file)
+        self.config_watcher = None
 
         # Threading
         self.monitor_thread = None
-        self.log_thread = None
+
+    def create_recorder(self):
+        """Open the snapshot recording named by record_file, if any"""
+        path = self.config.get("record_file", "")
+        if not path:
+            return None
+        try:
+            from netsupport_replay import SnapshotRecorder
+            recorder = SnapshotRecorder(path, self.config)
+            print(f"Recording detection snapshots to {path}")
+            return recorder
+        except Exception as e:
+            print(f"Snapshot recorder error: {e}")
+            return None
 
     def load_config(self) -> Dict[str, Any]:
         """Load configuration from file or return defaults"""
@@ -648,7 +814,39 @@ class NetSupportMonitorSimple:
             "silent_mode": False,
             "show_notifications": True,
             "language": "en",
-            "network_adapter": "all"
+            "network_adapter": "all",
+            "cache_ttl": 1.0,
+            "hybrid_confirm_interval": 30,
+            "detection_threshold": 1.0,
+            "detectors": {},
+            "probe_execution": "sequential",
+            "probe_timeouts": {"process": 1.0, "port": 2.0, "registry": 1.0},
+            "port_backend": "auto",
+            "port_scope": "auto",
+            "port_full_scan_interval": 30,
+            "adapter_refresh_interval": 10,
+            "event_source": "auto",
+            "max_scan_interval": 30,
+            "config_reload_interval": 2,
+            "heartbeat_interval": 30,
+            "status_heartbeat": 10,
+            "status_record": "netsupport_status.shm",
+            "status_server": "auto",
+            "status_push_interval": 5,
+            "stats_journal": "netsupport_stats.journal",
+            "stats_compact_every": 100,
+            "stats_compact_interval": 300,
+            "history_capacity": 1000,
+            "history_db": "netsupport_history.db",
+            "history_batch_size": 20,
+            "history_flush_interval": 60,
+            "runtime": "threads",
+            "job_timeouts": {"probe": 10.0},
+            "scan_backoff": 2.0,
+            "scan_jitter": 0.1,
+            "connect_confirmations": 1,
+            "disconnect_confirmations": 2,
+            "record_file": ""
         }
 
         if os.path.exists(self.config_file):
@@ -709,20 +907,76 @@ class NetSupportMonitorSimple:
         except Exception as e:
             print(f"Config save error: {e}")
 
+    def method_label(self) -> str:
+        """detection_method as text; a JSON list is joined with '+'"""
+        method = self.config.get("detection_method", "unknown")
+        if isinstance(method, (list, tuple)):
+            return "+".join(str(name) for name in method)
+        return str(method)
+
+    def status_snapshot(self) -> Dict[str, Any]:
+        """Current status as written to the status file and pushed to subscribers"""
+        return {
+            "connected": self.last_status or False,
+            "state": self.connection_state.state,
+            "last_check": self.last_check_time,
+            "method_used": self.method_label(),
+            "timestamp": time.time(),
+            "scan_interval": round(self.scan_scheduler.interval, 2),
+            "jobs": self.jobs.snapshot(),
+            "cache": self.snapshot_cache.stats(),
+            "planner": self.detection.planner.snapshot(),
+            "probes": {name: "unknown" if result is None else result
+                       for name, result in self.detection.results.items()}
+        }
+
     def save_status(self):
         """Save current status to shared file for CMD window"""
         try:
-            status_data = {
-                "connected": self.last_status or False,
-                "last_check": self.last_check_time,
-                "method_used": self.config.get("detection_method", "unknown"),
-                "timestamp": time.time()
-            }
-            with open(self.status_file, "w", encoding="utf-8") as f:
-                json.dump(status_data, f, indent=2)
+            status_data = self.status_snapshot()
+            self.status_publisher.publish(status_data)
+
+            # The shared-memory record is cheap enough to refresh every tick
+            if self.status_record:
+                timings = status_data["planner"]["probes"]
+                self.status_record.write(
+                    status_data["connected"], status_data["state"], status_data["method_used"],
+                    self.last_check_time,
+                    {name: (result, timings.get(name, {}).get("avg_ms", 0.0),
+                            timings.get(name, {}).get("runs", 0))
+                     for name, result in self.detection.results.items()})
         except Exception as e:
             print(f"Status save error: {e}")
 
+    def status_record_max_age(self) -> float:
+        """Seconds after which readers treat the status record as stale"""
+        # The record is written after every check, so several of the longest
+        # scan intervals without a write mean the monitor has stopped
+        return 3 * max(float(self.config.get("status_heartbeat", 10)),
+                       self.scan_scheduler.max_interval)
+
+    def create_status_record(self) -> Optional[StatusRecord]:
+        """Open the memory-mapped status record named by status_record, if any"""
+        path = self.config.get("status_record", "netsupport_status.shm")
+        if not path:
+            return None
+        try:
+            return StatusRecord(path)
+        except Exception as e:
+            print(f"Status record error: {e}")
+            return None
+
+    def create_history_store(self) -> Optional[HistoryStore]:
+        """Open the SQLite session history named by history_db, if any"""
+        path = self.config.get("history_db", "netsupport_history.db")
+        if not path:
+            return None
+        try:
+            return HistoryStore(path, self.config.get("history_batch_size", 20))
+        except Exception as e:
+            print(f"History store error: {e}")
+            return None
+
     def load_stats(self) -> Dict[str, Any]:
         """Load connection statistics"""
         default_stats = {
@@ -731,55 +985,73 @@ class NetSupportMonitorSimple:
             "last_connection_time": None,
             "total_connection_duration": 0,
             "last_reset": datetime.now().strftime("%Y-%m-%d"),
-            "connection_history": []
+            "connection_history": [],
+            "rollups": {}
         }
 
-        if os.path.exists(self.stats_file):
-            try:
-                with open(self.stats_file, "r", encoding="utf-8") as f:
-                    loaded = json.load(f)
-                    # Reset daily counter if new day
-                    if loaded.get("last_reset") != datetime.now().strftime("%Y-%m-%d"):
-                        loaded["connections_today"] = 0
-                        loaded["last_reset"] = datetime.now().strftime("%Y-%m-%d")
-                    return {**default_stats, **loaded}
-            except Exception as e:
-                print(f"Stats load error: {e}")
+        try:
+            # Snapshot plus the journal records written since its compaction
+            loaded = {**default_stats, **self.stats_journal.recover()}
+        except Exception as e:
+            print(f"Stats load error: {e}")
+            return default_stats
 
-        return default_stats
+        # Reset daily counter if new day
+        if loaded.get("last_reset") != datetime.now().strftime("%Y-%m-%d"):
+            loaded["connections_today"] = 0
+            loaded["last_reset"] = datetime.now().strftime("%Y-%m-%d")
+        return loaded
 
     def save_stats(self):
-        """Save connection statistics"""
+        """Compact the stats journal into the snapshot file"""
         try:
-            with open(self.stats_file, "w", encoding="utf-8") as f:
-                json.dump(self.stats, f, indent=2)
+            self.stats_journal.compact(self.stats)
         except Exception as e:
             print(f"Stats save error: {e}")
 
+    def compact_stats_job(self):
+        """Scheduled job: fold journaled connection events into the snapshot"""
+        if self.stats_journal.pending:
+            self.save_stats()
+
     def update_stats(self, connected: bool):
         """Update connection statistics"""
         if connected and not self.last_status:
             # New connection detected
-            self.stats["total_connections"] += 1
-            self.stats["connections_today"] += 1
-            self.stats["last_connection_time"] = time.time()
-
-            # Add to history (keep last 50)
-            history_entry = {
-                "timestamp": time.time(),
-                "datetime": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            }
-            self.stats["connection_history"].append(history_entry)
-            if len(self.stats["connection_history"]) > 50:
-                self.stats["connection_history"] = self.stats["connection_history"][-50:]
-
-            self.save_stats()
+            event = {"e": "connect", "t": time.time()}
         elif not connected and self.last_status:
-            # Connection ended - calculate duration
-            if self.stats.get("last_connection_time"):
-                duration = time.time() - self.stats["last_connection_time"]
-                self.stats["total_connection_duration"] += duration
-                self.save_stats()
+            # Connection ended - duration is added when the event is applied
+            event = {"e": "disconnect", "t": time.time()}
+        else:
+            return
+
+        try:
+            # One appended journal line per event, whatever the history size
+            if self.stats_journal.append(self.stats, event):
+                self.jobs.trigger("stats_compact")
+        except Exception as e:
+            print(f"Stats save error: {e}")
+
+        if self.history_store:
+            try:
+                if event["e"] == "connect":
+                    probe = next((name for name, hit in self.detection.results.items() if hit), None)
+                    self.history_store.start(event["t"], probe, self.last_peer)
+                elif self.history_store.end(event["t"]):
+                    self.jobs.trigger("history_flush")
+            except Exception as e:
+                print(f"History store error: {e}")
+
+        if event["e"] == "disconnect":
+            self.last_peer = None
+
+    def flush_history_job(self):
+        """Scheduled job: write queued sessions to the history database"""
+        if self.history_store and self.history_store.pending:
+            try:
+                self.history_store.flush()
+            except Exception as e:
+                print(f"History store error: {e}")
 
     def setup_auto_start(self, enable: bool):
         """Setup auto-start with Windows"""
@@ -844,26 +1116,18 @@ class NetSupportMonitorSimple:
         except Exception:
             return False
 
-    @lru_cache(maxsize=32)
-    def get_netsupport_processes(self, cache_key: int) -> frozenset:
-        """Cached NetSupport process detection"""
-        netsupport_processes = frozenset([
-            'pcinssvc.exe', 'student.exe', 'tutor.exe',
-            'client32.exe', 'netsupport.exe', 'pcicfgui.exe',
-            'pciconfa.exe', 'nsm.exe', 'remote32.exe'
-        ])
-
+    def scan_netsupport_processes(self) -> frozenset:
+        """Scan the process table for NetSupport processes"""
         try:
-            current_processes = set()
-            for proc in psutil.process_iter(['pid', 'name'], ad_value=''):
-                proc_name = proc.info.get('name', '').lower()
-                if proc_name in [p.lower() for p in netsupport_processes]:
-                    current_processes.add(proc_name)
-            return frozenset(current_processes)
+            return self.process_scanner.scan()
         except Exception as e:
             print(f"Process scan error: {e}")
             return frozenset()
 
+    def get_netsupport_processes(self) -> frozenset:
+        """Cached NetSupport process detection"""
+        return self.snapshot_cache.get("process", self.scan_netsupport_processes)
+
     def check_netsupport_registry(self) -> bool:
         """Check Windows registry for NetSupport activity"""
         if not WINDOWS_AVAILABLE:
@@ -903,23 +1167,38 @@ class NetSupportMonitorSimple:
             print(f"Network adapter list error: {e}")
             return []
 
+    def get_port_connections(self, target_port: int) -> list:
+        """Return connections to inspect for the port check"""
+        backend = self.config.get("port_backend", "auto")
+        if LINUX and backend != "psutil":
+            # Only ESTABLISHED sockets on the target port leave the kernel
+            if self.linux_port_probe is None:
+                self.linux_port_probe = LinuxPortProbe(backend)
+            return self.linux_port_probe.established(target_port)
+
+        # Narrow to the sockets of known NetSupport processes when possible
+        if self.config.get("port_scope", "auto") != "system":
+            self.get_netsupport_processes()
+            candidates = self.process_scanner.pids()
+            if candidates and not self.pid_port_probe.full_scan_due():
+                return self.pid_port_probe.connections(candidates)
+
+        self.pid_port_probe.mark_full_scan()
+        return psutil.net_connections(kind="inet")
+
     def check_netsupport_port(self) -> bool:
         """Check for NetSupport port connections"""
         target_port = int(self.config.get("port", 5405))
         selected_adapter = self.config.get("network_adapter", "all")
 
         try:
-            connections = psutil.net_connections(kind="inet")
+            connections = self.get_port_connections(target_port)
 
-            # Get adapter IP addresses if specific adapter selected
-            adapter_ips = set()
+            # Get adapter IP addresses (IPv4 and IPv6) if specific adapter selected
+            adapter_ips = frozenset()
             if selected_adapter != "all":
                 try:
-                    addrs = psutil.net_if_addrs()
-                    if selected_adapter in addrs:
-                        for addr in addrs[selected_adapter]:
-                            if addr.family == 2:  # AF_INET (IPv4)
-                                adapter_ips.add(addr.address)
+                    adapter_ips = self.adapter_cache.addresses(selected_adapter)
                 except Exception as e:
                     print(f"Adapter IP lookup error: {e}")
 
@@ -930,41 +1209,139 @@ class NetSupportMonitorSimple:
 
                     # If specific adapter selected, check if connection is on that adapter
                     if selected_adapter != "all":
-                        if conn.laddr.ip not in adapter_ips:
+                        if conn.laddr.ip.split("%", 1)[0] not in adapter_ips:
                             continue
 
+                    # Remembered for the session history
+                    if conn.raddr:
+                        self.last_peer = f"{conn.raddr.ip}:{conn.raddr.port}"
                     return True
         except Exception as e:
             print(f"Port check error: {e}")
 
         return False
 
+    def port_listening(self, target_port: int) -> bool:
+        """Check whether something listens on the NetSupport port"""
+        try:
+            if LINUX and self.config.get("port_backend", "auto") != "psutil":
+                if self.linux_port_probe is None:
+                    self.linux_port_probe = LinuxPortProbe(self.config.get("port_backend", "auto"))
+                return self.linux_port_probe.listening(target_port)
+
+            # Elsewhere only the sockets of known NetSupport processes are read
+            for conn in self.pid_port_probe.connections(self.process_scanner.pids()):
+                if conn.status == "LISTEN" and conn.laddr and conn.laddr.port == target_port:
+                    return True
+        except Exception as e:
+            print(f"Listener check error: {e}")
+        return False
+
+    def weak_signal(self) -> bool:
+        """True when a NetSupport process or port listener appeared since the last tick"""
+        pids = frozenset(self.process_scanner.pids())
+        listening = self.port_listening(int(self.config.get("port", 5405)))
+        appeared = bool(pids - self.signal_pids) or (listening and not self.signal_listener)
+        self.signal_pids = pids
+        self.signal_listener = listening
+        return appeared
+
+    def build_detection(self, config: Optional[Dict[str, Any]] = None) -> DetectionScheduler:
+        """Create the detector scheduler for the configured detection_method"""
+        config = self.config if config is None else config
+        names = parse_detection_method(config.get("detection_method", "process"))
+        return DetectionScheduler(self, names, config.get("detectors", {}),
+                                  config.get("hybrid_confirm_interval", 30),
+                                  config.get("detection_threshold", 1.0))
+
     def check_connection(self) -> bool:
         """Main connection check"""
         method = self.config.get("detection_method", "process")
 
         try:
-            if method == "process":
-                cache_key = int(time.time() // self.config.get("scan_interval", 2))
-                processes = self.get_netsupport_processes(cache_key)
-                return len(processes) > 0
+            concurrent = self.config.get("probe_execution", "sequential") == "concurrent"
+            return self.detection.check(concurrent, self.config.get("probe_timeouts", {}))
+        except Exception as e:
+            print(f"Connection check error ({method}): {e}")
 
-            elif method == "port":
-                return self.check_netsupport_port()
+        return False
 
-            elif method == "registry" and WINDOWS_AVAILABLE:
-                return self.check_netsupport_registry()
+    def on_process_event(self, pid: int, name: str):
+        """A NetSupport process started or exited: check right away"""
+        self.snapshot_cache.invalidate("process")
+        self.scan_scheduler.burst()
+        self.jobs.trigger("probe")
 
-            elif method == "hybrid":
-                process_detected = bool(self.get_netsupport_processes(int(time.time() // 5)))
-                port_detected = self.check_netsupport_port()
-                registry_detected = self.check_netsupport_registry() if WINDOWS_AVAILABLE else False
-                return process_detected or port_detected or registry_detected
+    def start_event_source(self, loop=None):
+        """Subscribe to process events if the platform supports it"""
+        if self.config.get("event_source", "auto") == "off":
+            return
 
-        except Exception as e:
-            print(f"Connection check error ({method}): {e}")
+        self.event_source = ProcessEventSource(
+            lambda name: self.process_scanner.index.match_name(name),
+            self.on_process_event
+        )
+        backend = self.event_source.start(loop)
+        if backend:
+            print("Process events:", backend)
+            if backend == "proc_poll":
+                self.jobs.add("proc_poll", self.event_source.poll_interval, self.event_source.poll,
+                              delay=self.event_source.poll_interval)
+        else:
+            self.event_source = None
+        self.configure_scan_pacing()
+
+    def kernel_port_filter(self) -> bool:
+        """True when the port check only reads ESTABLISHED sockets filtered in the kernel"""
+        return LINUX and self.config.get("port_backend", "auto") != "psutil"
+
+    def watch_covers_detectors(self) -> bool:
+        """True when the watch job alone notices every configured detector turning positive"""
+        # Process and registry checks are cheap; the port check only with kernel filtering
+        return "port" not in self.detection.detectors or self.kernel_port_filter()
+
+    def idle_scan_ceiling(self) -> float:
+        """Longest idle interval; above 2x scan_interval only while the watch job covers detection"""
+        ceiling = float(self.config.get("max_scan_interval", 30))
+        if not self.watch_covers_detectors():
+            # Nothing but the full probe would notice a new connection
+            ceiling = min(ceiling, 2 * float(self.config.get("scan_interval", 2)))
+        return ceiling
+
+    def watch_signal(self) -> bool:
+        """True when a cheap check finds a process or session the last probe did not report"""
+        detectors = self.detection.detectors
+        if "process" in detectors and self.event_source is None:
+            if self.get_netsupport_processes():
+                return True
+        if "registry" in detectors and self.check_netsupport_registry():
+            return True
+        return "port" in detectors and self.kernel_port_filter() and self.check_netsupport_port()
 
-        return False
+    def watch_job(self):
+        """Scheduled job: cheap checks on every scan_interval tick while the probe backs off"""
+        if self.scan_scheduler.interval <= self.scan_scheduler.base_interval:
+            # The probe itself runs on the short interval
+            return
+        # Skip the tick while a probe runs; it sees the same sockets and processes
+        if not self.detection_lock.acquire(blocking=False):
+            return
+        try:
+            signal = self.watch_signal()
+        finally:
+            self.detection_lock.release()
+        if signal:
+            self.scan_scheduler.burst()
+            self.jobs.trigger("probe")
+
+    def configure_scan_pacing(self):
+        """Apply the scan_* settings to the adaptive scan scheduler"""
+        self.scan_scheduler.configure(
+            self.config.get("scan_interval", 2),
+            self.idle_scan_ceiling(),
+            self.config.get("scan_backoff", 2.0),
+            self.config.get("scan_jitter", 0.1)
+        )
 
     def log_status(self, message: str):
         """Buffered logging system"""
@@ -973,29 +1350,33 @@ class NetSupportMonitorSimple:
 
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         log_entry = f"{timestamp} - {message}\n"
-        self.log_buffer.append(log_entry)
-
         buffer_size = self.config.get("log_buffer_size", 10)
         flush_interval = self.config.get("log_flush_interval", 30)
 
-        should_flush = (len(self.log_buffer) >= buffer_size or
-                       time.time() - self.last_flush > flush_interval)
+        with self.log_lock:
+            self.log_buffer.append(log_entry)
+            should_flush = (len(self.log_buffer) >= buffer_size or
+                           time.time() - self.last_flush > flush_interval)
 
         if should_flush:
             self.flush_logs()
 
     def flush_logs(self):
         """Flush log buffer to file"""
-        if not self.log_buffer:
-            return
+        with self.log_lock:
+            if not self.log_buffer:
+                return
+            entries, self.log_buffer = self.log_buffer, []
 
         try:
             with open(self.log_file, "a", encoding="utf-8") as f:
-                f.writelines(self.log_buffer)
-            self.log_buffer.clear()
+                f.writelines(entries)
             self.last_flush = time.time()
         except Exception as e:
             print(f"Log flush error: {e}")
+            # Keep the entries for the next flush
+            with self.log_lock:
+                self.log_buffer[:0] = entries
 
     def load_icon_from_file(self, filename: str) -> Optional[Image.Image]:
         """Load icon from file if it exists"""
@@ -1136,8 +1517,19 @@ class NetSupportMonitorSimple:
     def reload_config(self):
         """Reload configuration from file (live reload)"""
         try:
-            old_config = self.config.copy()
-            self.config = self.load_config()
+            with self.detection_lock:
+                old_config = self.config.copy()
+                config = self.load_config()
+
+                # Only settings that actually changed touch caches and schedulers
+                changed = {key for key in set(old_config) | set(config)
+                           if old_config.get(key) != config.get(key)}
+                # Anything the new values break raises here, before the running
+                # config, caches or schedulers change
+                prepared = self.prepare_config_changes(config, changed)
+                self.config = config
+                if changed:
+                    self.apply_config_changes(changed, prepared)
 
             # Check if detection method changed
             if old_config.get("detection_method") != self.config.get("detection_method"):
@@ -1152,68 +1544,273 @@ class NetSupportMonitorSimple:
             print(f"Config reload error: {e}")
             return False
 
-    def background_monitor(self):
-        """Background monitoring thread"""
-        last_config_check = time.time()
+    # Changed values of these keys must convert to numbers before a reload is applied
+    NUMERIC_CONFIG_KEYS = {
+        "cache_ttl", "port_full_scan_interval", "adapter_refresh_interval",
+        "hybrid_confirm_interval", "detection_threshold", "scan_interval",
+        "max_scan_interval", "scan_backoff", "scan_jitter", "config_reload_interval",
+        "status_heartbeat", "status_push_interval", "heartbeat_interval",
+        "log_flush_interval", "stats_compact_interval", "history_flush_interval",
+        "history_batch_size", "history_capacity", "stats_compact_every",
+        "connect_confirmations", "disconnect_confirmations"
+    }
+    SIGNATURE_CONFIG_KEYS = {"process_signatures", "process_patterns",
+                             "process_exe_rules", "process_cmdline_rules"}
+    DETECTION_CONFIG_KEYS = {"detection_method", "detectors",
+                             "hybrid_confirm_interval", "detection_threshold"}
+
+    def prepare_config_changes(self, config: Dict[str, Any], changed: Set[str]) -> Dict[str, Any]:
+        """Validate changed keys and build their new objects; raises instead of applying"""
+        for key in changed & self.NUMERIC_CONFIG_KEYS:
+            if key in config:
+                float(config[key])
+        prepared = {}
+        if changed & self.SIGNATURE_CONFIG_KEYS:
+            prepared["index"] = SignatureIndex.from_config(config)
+        if changed & self.DETECTION_CONFIG_KEYS:
+            prepared["detection"] = self.build_detection(config)
+        return prepared
+
+    def apply_config_changes(self, changed: Set[str], prepared: Dict[str, Any]):
+        """Push changed config keys and their prepared objects to caches and schedulers"""
+        if "cache_ttl" in changed:
+            self.snapshot_cache.ttl = float(self.config.get("cache_ttl", 1.0))
+            self.pid_port_probe.ttl = float(self.config.get("cache_ttl", 1.0))
+        if "port_backend" in changed:
+            self.linux_port_probe = None
+        if "port_full_scan_interval" in changed:
+            self.pid_port_probe.full_scan_interval = float(
+                self.config.get("port_full_scan_interval", 30))
+        if changed & {"adapter_refresh_interval", "network_adapter"}:
+            self.adapter_cache.refresh_interval = float(
+                self.config.get("adapter_refresh_interval", 10))
+            self.adapter_cache.refresh(force=True)
+
+        # Swap in the signature index only when the signature lists changed
+        if "index" in prepared:
+            self.process_scanner.index = prepared["index"]
+            self.process_scanner.reset()
+            self.snapshot_cache.invalidate("process")
+
+        # Rebuild the detector scheduler when the detector selection changed,
+        # otherwise only drop the cached results of affected detectors
+        if "detection" in prepared:
+            self.detection.shutdown()
+            self.detection = prepared["detection"]
+        else:
+            self.detection.invalidate(changed)
+
+        if (changed & {"scan_interval", "max_scan_interval", "scan_backoff", "scan_jitter",
+                       "port_backend"} or "detection" in prepared):
+            self.configure_scan_pacing()
+            self.jobs.set_interval("watch", self.config.get("scan_interval", 2))
+        if "config_reload_interval" in changed:
+            self.jobs.set_interval("config", self.config_poll_interval())
+        if "status_heartbeat" in changed:
+            self.status_publisher.heartbeat = float(self.config.get("status_heartbeat", 10))
+        if "status_push_interval" in changed:
+            self.jobs.set_interval("status_push", self.config.get("status_push_interval", 5))
+        if "heartbeat_interval" in changed:
+            self.jobs.set_interval("heartbeat", self.config.get("heartbeat_interval", 30))
+        if "log_flush_interval" in changed:
+            self.jobs.set_interval("log_flush", self.config.get("log_flush_interval", 30))
+        if "stats_compact_interval" in changed:
+            self.jobs.set_interval("stats_compact", self.config.get("stats_compact_interval", 300))
+        if "history_flush_interval" in changed:
+            self.jobs.set_interval("history_flush", self.config.get("history_flush_interval", 60))
+        if "history_batch_size" in changed and self.history_store:
+            self.history_store.batch_size = max(1, int(self.config.get("history_batch_size", 20)))
+        if "history_capacity" in changed:
+            self.stats_journal.resize_history(self.stats, self.config.get("history_capacity", 1000))
+        if "stats_compact_every" in changed:
+            self.stats_journal.compact_every = max(1, int(self.config.get("stats_compact_every", 100)))
+        if "job_timeouts" in changed and self.async_runtime:
+            self.async_runtime.timeouts = self.config.get("job_timeouts", {})
+
+        if changed & {"connect_confirmations", "disconnect_confirmations"}:
+            self.connection_state.connect_confirmations = max(
+                1, int(self.config.get("connect_confirmations", 1)))
+            self.connection_state.disconnect_confirmations = max(
+                1, int(self.config.get("disconnect_confirmations", 2)))
+
+    def config_poll_interval(self) -> float:
+        """Seconds between config file checks; only a fallback with a watcher"""
+        if self.config_watcher:
+            return 3600.0
+        return self.config.get("config_reload_interval", 2)
+
+    def on_config_change(self):
+        """config.json was written: reload it on the scheduler thread"""
+        self.jobs.trigger("config")
+
+    def start_config_watcher(self, loop=None):
+        """Watch config.json for changes if the platform supports it"""
+        self.config_watcher = ConfigWatcher(self.config_file, self.on_config_change)
+        backend = self.config_watcher.start(loop)
+        if backend:
+            print("Config watcher:", backend)
+        else:
+            self.config_watcher = None
+        self.jobs.set_interval("config", self.config_poll_interval())
 
-        while self.running:
-            try:
-                # Reload config every 10 seconds for live updates
-                if time.time() - last_config_check > 10:
-                    self.reload_config()
-                    last_config_check = time.time()
+    def probe_job(self) -> float:
+        """Scheduled job: run one connection check and return the next interval"""
+        with self.detection_lock:
+            return self.run_probe()
 
-                start_time = time.time()
-                connected = self.check_connection()
-                check_duration = time.time() - start_time
+    def run_probe(self) -> float:
+        """Check, debounce, report a confirmed transition and pick the next interval"""
+        start_time = time.time()
+        # Set again by the port check only if this check found the connection
+        self.last_peer = None
+        detected = self.check_connection()
+        check_duration = time.time() - start_time
 
-                status_changed = connected != self.last_status
-                time_passed = (self.last_check_time is None or
-                              time.time() - self.last_check_time > 30)
+        if self.recorder:
+            self.recorder.capture(detected)
 
-                # Always update timestamp for refresh functionality
-                self.last_check_time = time.time()
-                self.save_status()
+        # Only confirmed transitions count as a status change
+        transition = self.connection_state.update(detected)
+        connected = self.connection_state.connected
 
-                if status_changed or time_passed:
-                    self.update_tray_icon(connected)
+        self.last_check_time = time.time()
 
-                    status_msg = "Teacher connected" if connected else "No connection"
-                    self.log_status(f"{status_msg} (check: {check_duration:.2f}s)")
+        if transition is not None:
+            self.update_tray_icon(connected)
+
+            status_msg = "Teacher connected" if connected else "No connection"
+            self.log_status(f"{status_msg} (check: {check_duration:.2f}s)")
+
+            # Update stats and show Windows notification on confirmed changes
+            self.update_stats(connected)
+            self.show_notification(connected)
+            self.last_status = connected
+
+            if self.status_server:
+                self.status_server.publish({
+                    "type": "transition",
+                    "connected": connected,
+                    "state": self.connection_state.state,
+                    "time": self.last_check_time,
+                    "probes": {name: "unknown" if result is None else result
+                               for name, result in self.detection.results.items()}
+                })
+
+        # Written only on changes, plus a heartbeat so last_check stays fresh
+        self.save_status()
+
+        # Back off while idle; weak signals are only probed when idle
+        active = connected or self.connection_state.settling
+        signal = not active and self.weak_signal()
+        return self.scan_scheduler.next_delay(active, signal)
+
+    def config_job(self):
+        """Scheduled job: reload the config when the file changed (live updates)"""
+        signature = file_signature(self.config_file)
+        # A rejected file is retried on the next check instead of being skipped
+        if signature != self.config_signature and self.reload_config():
+            self.config_signature = signature
+
+    def heartbeat_job(self):
+        """Scheduled job: refresh the tray icon and log the current status"""
+        # Never writes last_status: run_probe compares it in update_stats
+        connected = self.connection_state.connected
+        self.update_tray_icon(connected)
+        self.log_status("Teacher connected" if connected else "No connection")
+
+    def status_push_job(self):
+        """Scheduled job: push a status snapshot to subscribers, if any"""
+        if self.status_server and self.status_server.clients:
+            self.status_server.publish({"type": "snapshot", **self.status_snapshot()})
+
+    def status_server_address(self) -> Optional[str]:
+        """Endpoint named by status_server, None when disabled"""
+        address = self.config.get("status_server", "auto")
+        if not address:
+            return None
+        if address == "auto":
+            address = default_status_address()
+        return address
+
+    def start_status_server(self):
+        """Serve pushed status updates to local subscribers"""
+        address = self.status_server_address()
+        if not address:
+            return
+        server = StatusServer(address, self.status_snapshot)
+        if server.start():
+            self.status_server = server
+            print("Status server:", address)
+
+    async def attach_event_loop(self, loop):
+        """asyncio runtime: serve events, config changes and subscribers from the loop"""
+        self.start_event_source(loop)
+        self.start_config_watcher(loop)
+        address = self.status_server_address()
+        if address:
+            server = StatusServer(address, self.status_snapshot)
+            if await server.start_async(loop):
+                self.status_server = server
+                print("Status server:", address)
+
+    def add_jobs(self):
+        """Register the periodic jobs on the deadline scheduler"""
+        self.jobs.add("probe", self.config.get("scan_interval", 2), self.probe_job, offload=True)
+        self.jobs.add("watch", self.config.get("scan_interval", 2), self.watch_job,
+                      delay=self.config.get("scan_interval", 2), offload=True)
+        self.jobs.add("heartbeat", self.config.get("heartbeat_interval", 30), self.heartbeat_job)
+        self.jobs.add("config", self.config_poll_interval(), self.config_job,
+                      delay=self.config_poll_interval(), offload=True)
+        self.jobs.add("log_flush", self.config.get("log_flush_interval", 30), self.flush_logs,
+                      delay=self.config.get("log_flush_interval", 30))
+        self.jobs.add("status_push", self.config.get("status_push_interval", 5),
+                      self.status_push_job, delay=self.config.get("status_push_interval", 5))
+        self.jobs.add("stats_compact", self.config.get("stats_compact_interval", 300),
+                      self.compact_stats_job, delay=self.config.get("stats_compact_interval", 300),
+                      offload=True)
+        self.jobs.add("history_flush", self.config.get("history_flush_interval", 60),
+                      self.flush_history_job, delay=self.config.get("history_flush_interval", 60),
+                      offload=True)
+
+    def background_monitor(self):
+        """Background monitoring thread: runs all periodic jobs until exit"""
+        self.add_jobs()
+        self.jobs.run(lambda: self.running)
 
-                    # Update stats
-                    self.update_stats(connected)
+    def exit_program(self):
+        """Clean shutdown"""
+        print("Shutting down NetSupport Monitor...")
 
-                    # Show Windows notification on status change
-                    if status_changed:
-                        self.show_notification(connected)
+        self.running = False
+        self.flush_logs()
 
-                    self.last_status = connected
+        self.detection.shutdown()
 
-                base_interval = self.config.get("scan_interval", 2)
-                sleep_interval = base_interval if connected else base_interval * 2
-                time.sleep(max(0.5, sleep_interval - check_duration))
+        if self.recorder:
+            self.recorder.close()
 
-            except Exception as e:
-                print(f"Monitor thread error: {e}")
-                time.sleep(5)
+        self.compact_stats_job()
+        self.stats_journal.close()
 
-    def log_worker(self):
-        """Background log flushing thread"""
-        while self.running:
+        if self.history_store:
             try:
-                time.sleep(self.config.get("log_flush_interval", 30))
-                if self.log_buffer:
-                    self.flush_logs()
+                self.history_store.close()
             except Exception as e:
-                print(f"Log worker error: {e}")
+                print(f"History store error: {e}")
 
-    def exit_program(self):
-        """Clean shutdown"""
-        print("Shutting down NetSupport Monitor...")
+        if self.event_source:
+            self.event_source.stop()
 
-        self.running = False
-        self.flush_logs()
+        if self.config_watcher:
+            self.config_watcher.stop()
+
+        if self.status_record:
+            self.status_record.close()
+
+        if self.status_server:
+            self.status_server.stop()
+
+        self.jobs.interrupt()
 
         if self.tray_icon:
             try:
@@ -1221,10 +1818,9 @@ class NetSupportMonitorSimple:
             except Exception:
                 pass
 
-        # Wait for threads
-        for thread in [self.monitor_thread, self.log_thread]:
-            if thread and thread.is_alive():
-                thread.join(timeout=2)
+        # Wait for the monitor thread
+        if self.monitor_thread and self.monitor_thread.is_alive():
+            self.monitor_thread.join(timeout=2)
 
         sys.exit(0)
 
@@ -1242,33 +1838,45 @@ class NetSupportMonitorSimple:
         tray_thread = threading.Thread(target=self.start_tray, daemon=True)
         tray_thread.start()
 
-        # Start monitoring thread
-        self.monitor_thread = threading.Thread(target=self.background_monitor, daemon=True)
-        self.monitor_thread.start()
+        # The asyncio runtime runs every job, event source and the status
+        # server on an event loop in this thread
+        use_asyncio = self.config.get("runtime", "threads") == "asyncio"
+
+        if not use_asyncio:
+            # Start process event source (falls back to polling when unavailable)
+            self.start_event_source()
+
+            # Apply config.json changes as soon as they are saved
+            self.start_config_watcher()
+
+            # Push status to local subscribers instead of having them poll files
+            self.start_status_server()
 
-        # Start log worker if logging enabled
-        if self.config.get("logging", False):
-            self.log_thread = threading.Thread(target=self.log_worker, daemon=True)
-            self.log_thread.start()
+            # Start monitoring thread
+            self.monitor_thread = threading.Thread(target=self.background_monitor, daemon=True)
+            self.monitor_thread.start()
 
         # Wait for tray to be ready
         self.tray_ready.wait(timeout=3.0)
 
-        # Perform initial scan
-        time.sleep(1)
-        connected = self.check_connection()
-        self.update_tray_icon(connected)
-        self.last_status = connected
-        self.last_check_time = time.time()
+        # Show the result of the monitor thread's first scan
+        if not use_asyncio:
+            time.sleep(1)
+            self.update_tray_icon(self.connection_state.connected)
 
         print("✅ NetSupport Monitor draait in system tray")
         print("🖱️  Rechtsklik op tray icon voor opties")
         print("📊 'Toon details' voor CMD interface")
 
         try:
-            # Keep main thread alive
-            while self.running:
-                time.sleep(1)
+            if use_asyncio:
+                self.add_jobs()
+                self.async_runtime = AsyncRuntime(self.jobs, self.config.get("job_timeouts", {}))
+                self.async_runtime.run(lambda: self.running, self.attach_event_loop)
+            else:
+                # Keep main thread alive
+                while self.running:
+                    time.sleep(1)
         except KeyboardInterrupt:
             self.exit_program()
 
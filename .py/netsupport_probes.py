@@ -0,0 +1,569 @@
+# netsupport_probes.py - Shared detection helpers for the NetSupport tray monitors
+import fnmatch
+import re
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import psutil
+
+DEFAULT_PROCESS_SIGNATURES = (
+    'pcinssvc.exe', 'student.exe', 'tutor.exe',
+    'client32.exe', 'netsupport.exe', 'pcicfgui.exe',
+    'pciconfa.exe', 'nsm.exe', 'remote32.exe'
+)
+
+# Inline flags such as (?i) only work at the start of a whole expression
+GLOBAL_FLAGS = re.compile(r"\(\?[aiLmsux]+\)")
+
+
+class SignatureIndex:
+    """Process signature matcher compiled once from config
+
+    Plain names go into a hash set, glob names and regular expressions are
+    compiled into a single alternation, and optional exe-path and cmdline
+    substring rules are only consulted when the name itself did not match.
+    Patterns that cannot be embedded in an alternation (inline global flags,
+    groups, which could clash or get renumbered) are matched one by one.
+    """
+
+    def __init__(self, names: Iterable[str] = DEFAULT_PROCESS_SIGNATURES,
+                 patterns: Iterable[str] = (), exe_rules: Iterable[str] = (),
+                 cmdline_rules: Iterable[str] = ()):
+        self.exact = set()
+        regexes = []
+        self.separate: List[re.Pattern] = []
+        for name in names:
+            name = str(name).lower()
+            if any(c in name for c in "*?["):
+                regexes.append(fnmatch.translate(name))
+            else:
+                self.exact.add(name)
+        for pattern in patterns:
+            pattern = str(pattern)
+            try:
+                compiled = re.compile(pattern, re.IGNORECASE)
+            except re.error as e:
+                print(f"Invalid process pattern {pattern!r} skipped: {e}")
+                continue
+            if compiled.groups or GLOBAL_FLAGS.search(pattern):
+                self.separate.append(compiled)
+            else:
+                regexes.append(pattern)
+
+        self.pattern = None
+        if regexes:
+            try:
+                self.pattern = re.compile("|".join(f"(?:{r})" for r in regexes), re.IGNORECASE)
+            except re.error:
+                # Something still does not combine; match every expression on its own
+                self.separate.extend(re.compile(r, re.IGNORECASE) for r in regexes)
+
+        self.exe_rules = tuple(str(r).lower() for r in exe_rules)
+        self.cmdline_rules = tuple(str(r).lower() for r in cmdline_rules)
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "SignatureIndex":
+        """Build the index from the process_* keys in config.json"""
+        return cls(
+            config.get("process_signatures", DEFAULT_PROCESS_SIGNATURES),
+            config.get("process_patterns", []),
+            config.get("process_exe_rules", []),
+            config.get("process_cmdline_rules", [])
+        )
+
+    @property
+    def needs_details(self) -> bool:
+        """True when matching may need the exe path or command line"""
+        return bool(self.exe_rules or self.cmdline_rules)
+
+    def match_name(self, name: str) -> bool:
+        """Match a lowercase process name against names, globs and regexes"""
+        if name in self.exact:
+            return True
+        if self.pattern is not None and self.pattern.fullmatch(name) is not None:
+            return True
+        return any(pattern.fullmatch(name) for pattern in self.separate)
+
+    def match_details(self, exe: str, cmdline: str) -> bool:
+        """Match lowercase exe path and command line against substring rules"""
+        if exe and any(rule in exe for rule in self.exe_rules):
+            return True
+        return bool(cmdline) and any(rule in cmdline for rule in self.cmdline_rules)
+
+
+class ProcessScanner:
+    """Incremental process-table scanner that only inspects new processes
+
+    Keeps the PIDs of the previous scan keyed with their process start time,
+    resolves names only for processes that appeared since then and evicts
+    PIDs that exited. The start time is re-checked on every scan, so a
+    recycled PID (matched or not) is re-resolved right away. A full rescan
+    still runs every `rescan_every` scans.
+    """
+
+    def __init__(self, index: Optional[SignatureIndex] = None, rescan_every: int = 30):
+        self.index = index or SignatureIndex()
+        self.rescan_every = max(1, int(rescan_every))
+        self.known_pids: Dict[int, Optional[float]] = {}
+        self.matches: Dict[int, str] = {}
+        self.new_pids = 0
+        self.scans = 0
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """Forget all known PIDs so the next scan walks the full table"""
+        self.known_pids = {}
+        self.matches = {}
+
+    def resolve_name(self, pid: int) -> Optional[str]:
+        """Return the lowercase process name, or None if it cannot be read"""
+        try:
+            return psutil.Process(pid).name().lower()
+        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+            return None
+
+    def resolve_create_time(self, pid: int) -> Optional[float]:
+        """Return the process start time, or None if it cannot be read"""
+        try:
+            return psutil.Process(pid).create_time()
+        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+            return None
+
+    def resolve_details(self, pid: int) -> Tuple[str, str]:
+        """Return the lowercase exe path and command line of a process"""
+        try:
+            proc = psutil.Process(pid)
+            return proc.exe().lower(), " ".join(proc.cmdline()).lower()
+        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+            return "", ""
+
+    def matches_pid(self, pid: int, name: str) -> bool:
+        """Check a newly seen process against the signature index"""
+        if self.index.match_name(name):
+            return True
+        if self.index.needs_details:
+            return self.index.match_details(*self.resolve_details(pid))
+        return False
+
+    def pids(self) -> List[int]:
+        """Return the PIDs that matched during the last scan"""
+        with self._lock:
+            return list(self.matches)
+
+    def scan(self) -> frozenset:
+        """Return the NetSupport process names currently running"""
+        with self._lock:
+            return self._scan()
+
+    def _scan(self) -> frozenset:
+        if self.scans % self.rescan_every == 0:
+            self.reset()
+        self.scans += 1
+
+        current = {}
+        appeared = []
+        for pid in psutil.pids():
+            create_time = self.resolve_create_time(pid)
+            current[pid] = create_time
+            # A known PID whose start time changed was recycled by another process
+            if pid not in self.known_pids or self.known_pids[pid] != create_time:
+                self.matches.pop(pid, None)
+                appeared.append(pid)
+
+        for pid in self.known_pids.keys() - current.keys():
+            self.matches.pop(pid, None)
+
+        for pid in appeared:
+            name = self.resolve_name(pid)
+            if name and self.matches_pid(pid, name):
+                self.matches[pid] = name
+
+        self.new_pids = len(appeared)
+        self.known_pids = current
+        return frozenset(self.matches.values())
+
+
+class SnapshotCache:
+    """Per-monitor snapshot cache keyed by probe name with a monotonic TTL
+
+    Every detector that asks for the same probe within `ttl` seconds shares
+    one snapshot. Entries only live as long as the owning monitor.
+    """
+
+    def __init__(self, ttl: float = 1.0):
+        self.ttl = float(ttl)
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[str, Tuple[float, Any]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str, producer: Callable[[], Any], ttl: Optional[float] = None) -> Any:
+        """Return the cached snapshot for `name`, refreshing it when expired"""
+        now = time.monotonic()
+        if ttl is None:
+            ttl = self.ttl
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and now - entry[0] < ttl:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        value = producer()
+        with self._lock:
+            self._entries[name] = (time.monotonic(), value)
+        return value
+
+    def invalidate(self, name: Optional[str] = None):
+        """Drop one probe's snapshot, or all snapshots when no name is given"""
+        with self._lock:
+            if name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(name, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters for the status file"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "ttl": self.ttl
+            }
+
+
+class ProbePlanner:
+    """Cost-aware ordering of hybrid probes
+
+    Tracks an exponentially weighted average cost and a smoothed hit rate per
+    probe and orders probes by expected cost per detection (cost / hit rate).
+    Probes skipped after a positive result still run once every
+    `confirm_interval` seconds so their statistics stay current.
+    """
+
+    def __init__(self, names: Iterable[str], confirm_interval: float = 30.0,
+                 alpha: float = 0.2):
+        self.confirm_interval = float(confirm_interval)
+        self.alpha = alpha
+        self.probes: Dict[str, Dict[str, Any]] = {}
+        for name in names:
+            self.add(name)
+
+    def add(self, name: str, prior_cost: float = 0.0):
+        """Register a probe; `prior_cost` is used until it has been measured"""
+        self.probes.setdefault(name, {"avg_cost": prior_cost, "runs": 0, "hits": 0, "last_run": None})
+
+    def record(self, name: str, duration: float, hit: bool):
+        """Record the duration and outcome of one probe run"""
+        probe = self.probes[name]
+        if probe["runs"] == 0:
+            probe["avg_cost"] = duration
+        else:
+            probe["avg_cost"] += self.alpha * (duration - probe["avg_cost"])
+        probe["runs"] += 1
+        if hit:
+            probe["hits"] += 1
+        probe["last_run"] = time.monotonic()
+
+    def hit_rate(self, name: str) -> float:
+        """Laplace-smoothed hit rate so unseen probes are not ruled out"""
+        probe = self.probes[name]
+        return (probe["hits"] + 1) / (probe["runs"] + 2)
+
+    def expected_cost(self, name: str) -> float:
+        """Average cost divided by hit rate: the price of one detection"""
+        return self.probes[name]["avg_cost"] / self.hit_rate(name)
+
+    def order(self) -> List[str]:
+        """Return probe names cheapest-per-detection first"""
+        return sorted(self.probes, key=self.expected_cost)
+
+    def confirmation_due(self, name: str) -> bool:
+        """True when a probe has not run for `confirm_interval` seconds"""
+        last_run = self.probes[name]["last_run"]
+        return last_run is None or time.monotonic() - last_run >= self.confirm_interval
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return current ordering and timings for the status file"""
+        return {
+            "order": self.order(),
+            "probes": {
+                name: {
+                    "avg_ms": round(probe["avg_cost"] * 1000, 3),
+                    "runs": probe["runs"],
+                    "hits": probe["hits"],
+                    "hit_rate": round(self.hit_rate(name), 3)
+                }
+                for name, probe in self.probes.items()
+            }
+        }
+
+
+class ProbeExecutor:
+    """Runs probes concurrently on a small persistent thread pool
+
+    Every probe gets its own deadline. A probe that misses it is reported as
+    unknown (None) and is not resubmitted until its previous run finished, so
+    one slow call can never pile up work or block the tick.
+    """
+
+    def __init__(self, max_workers: int = 3):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers,
+                                       thread_name_prefix="netsupport-probe")
+        self.pending: Dict[str, Future] = {}
+
+    @staticmethod
+    def timed(probe: Callable[[], bool]) -> Tuple[bool, float]:
+        """Run a probe and return its result with its duration"""
+        start_time = time.perf_counter()
+        hit = bool(probe())
+        return hit, time.perf_counter() - start_time
+
+    def run(self, probes: Dict[str, Callable[[], bool]], deadlines: Dict[str, float],
+            default_deadline: float = 2.0,
+            stop_when: Optional[Callable[[Dict[str, Optional[bool]]], bool]] = None
+            ) -> Tuple[Dict[str, Optional[bool]], Dict[str, float]]:
+        """Run probes in parallel; return (results, durations) by probe name
+
+        Returns early once `stop_when(results)` is true; by default that is
+        the first positive result.
+        """
+        if stop_when is None:
+            stop_when = lambda partial: any(partial.values())
+
+        results: Dict[str, Optional[bool]] = {name: None for name in probes}
+        durations: Dict[str, float] = {}
+        start_time = time.monotonic()
+
+        waiting = {}
+        for name, probe in probes.items():
+            previous = self.pending.get(name)
+            if previous is not None and not previous.done():
+                continue
+            future = self.pool.submit(self.timed, probe)
+            self.pending[name] = future
+            waiting[future] = (name, start_time + float(deadlines.get(name, default_deadline)))
+
+        while waiting:
+            now = time.monotonic()
+            for future, (name, deadline) in list(waiting.items()):
+                if deadline <= now and not future.done():
+                    del waiting[future]
+            if not waiting:
+                break
+
+            next_deadline = min(deadline for _, deadline in waiting.values())
+            done, _ = wait(list(waiting), timeout=max(0.0, next_deadline - now),
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                name, _ = waiting.pop(future)
+                try:
+                    results[name], durations[name] = future.result()
+                except Exception as e:
+                    print(f"Probe error ({name}): {e}")
+                    continue
+                if stop_when(results):
+                    for other in waiting:
+                        other.cancel()
+                    return results, durations
+
+        return results, durations
+
+    def shutdown(self):
+        """Stop the pool without waiting for probes that are still running"""
+        self.pool.shutdown(wait=False)
+
+
+class Detector:
+    """Base class for connection detectors registered by name
+
+    Subclasses set the metadata below and implement `detect`. `cost` is the
+    expected run time in milliseconds (used until the planner has measured
+    it), `ttl` is how long a result may be reused, `platforms` lists the
+    sys.platform prefixes the detector works on (empty means all) and
+    `confidence` is the weight a positive result adds to the detection score.
+    Every value except `platforms` can be overridden per detector in the
+    "detectors" section of config.json. `config_keys` names the settings
+    the detector reads, so a change to them drops its cached result.
+    """
+
+    name = ""
+    cost = 1.0
+    ttl = 0.0
+    platforms: Tuple[str, ...] = ()
+    confidence = 1.0
+    config_keys: Tuple[str, ...] = ()
+
+    def __init__(self, overrides: Optional[Dict[str, Any]] = None):
+        for key in ("cost", "ttl", "confidence"):
+            if overrides and key in overrides:
+                setattr(self, key, float(overrides[key]))
+
+    @classmethod
+    def available(cls) -> bool:
+        """True when the detector can run on this platform"""
+        return not cls.platforms or sys.platform.startswith(cls.platforms)
+
+    def detect(self, monitor) -> bool:
+        """Return True when a NetSupport connection is detected"""
+        raise NotImplementedError
+
+
+DETECTORS: Dict[str, type] = {}
+
+
+def register_detector(cls: type) -> type:
+    """Class decorator that makes a Detector selectable by its name"""
+    DETECTORS[cls.name] = cls
+    return cls
+
+
+@register_detector
+class ProcessDetector(Detector):
+    """NetSupport client processes are running"""
+    name = "process"
+    cost = 0.5
+    config_keys = ("process_signatures", "process_patterns",
+                   "process_exe_rules", "process_cmdline_rules")
+
+    def detect(self, monitor) -> bool:
+        return bool(monitor.get_netsupport_processes())
+
+
+@register_detector
+class PortDetector(Detector):
+    """An ESTABLISHED connection exists on the NetSupport port"""
+    name = "port"
+    cost = 20.0
+    config_keys = ("port", "network_adapter", "port_backend", "port_scope")
+
+    def detect(self, monitor) -> bool:
+        return monitor.check_netsupport_port()
+
+
+@register_detector
+class RegistryDetector(Detector):
+    """The NetSupport School registry key reports a connection"""
+    name = "registry"
+    cost = 1.0
+    platforms = ("win32",)
+
+    def detect(self, monitor) -> bool:
+        return monitor.check_netsupport_registry()
+
+
+def parse_detection_method(value: Any) -> List[str]:
+    """Turn detection_method into detector names
+
+    Accepts a single name ("process"), "hybrid" for every registered
+    detector, a list of names or an expression such as "process+port".
+    Unknown names are dropped.
+    """
+    if isinstance(value, (list, tuple)):
+        names = [str(name).strip() for name in value]
+    elif value == "hybrid":
+        names = list(DETECTORS)
+    else:
+        names = [name.strip() for name in re.split(r"[+,|]", str(value))]
+    return [name for name in names if name in DETECTORS]
+
+
+class DetectionScheduler:
+    """Runs the configured detectors generically
+
+    Results are cached per detector TTL, detectors are ordered by the
+    ProbePlanner and optionally run in parallel on a ProbeExecutor. A check
+    is positive once the confidence of the positive detectors reaches
+    `threshold`; remaining detectors are then skipped until their
+    confirmation run is due.
+    """
+
+    def __init__(self, monitor, names: Iterable[str], overrides: Optional[Dict[str, Any]] = None,
+                 confirm_interval: float = 30.0, threshold: float = 1.0):
+        overrides = overrides or {}
+        self.monitor = monitor
+        self.threshold = float(threshold)
+        self.detectors: Dict[str, Detector] = {}
+        for name in names:
+            cls = DETECTORS.get(name)
+            if cls is not None and cls.available():
+                self.detectors[name] = cls(overrides.get(name))
+
+        self.planner = ProbePlanner((), confirm_interval)
+        for name, detector in self.detectors.items():
+            self.planner.add(name, detector.cost / 1000)
+
+        self.executor: Optional[ProbeExecutor] = None
+        self.results: Dict[str, Optional[bool]] = {}
+
+    def probe(self, name: str) -> Callable[[], bool]:
+        """Return a callable running one detector through the snapshot cache"""
+        detector = self.detectors[name]
+
+        def run() -> bool:
+            if detector.ttl > 0:
+                return self.monitor.snapshot_cache.get(
+                    f"detector:{name}", lambda: detector.detect(self.monitor), detector.ttl)
+            return bool(detector.detect(self.monitor))
+
+        return run
+
+    def invalidate(self, changed_keys: Iterable[str]) -> List[str]:
+        """Drop cached results of detectors that read any of `changed_keys`"""
+        changed = set(changed_keys)
+        affected = [name for name, detector in self.detectors.items()
+                    if changed.intersection(detector.config_keys)]
+        for name in affected:
+            self.monitor.snapshot_cache.invalidate(f"detector:{name}")
+        return affected
+
+    def score(self, results: Dict[str, Optional[bool]]) -> float:
+        """Sum of confidence weights of the positive detectors"""
+        return sum(self.detectors[name].confidence for name, hit in results.items() if hit)
+
+    def check(self, concurrent: bool = False, timeouts: Optional[Dict[str, float]] = None) -> bool:
+        """Run the detectors and return the combined result"""
+        if not self.detectors:
+            self.results = {}
+            return False
+        if concurrent and len(self.detectors) > 1:
+            return self.check_concurrent(timeouts or {})
+
+        results: Dict[str, Optional[bool]] = {}
+        for name in self.planner.order():
+            # Once detected, other detectors only run on their confirmation cadence
+            if self.score(results) >= self.threshold and not self.planner.confirmation_due(name):
+                continue
+
+            start_time = time.perf_counter()
+            hit = bool(self.probe(name)())
+            self.planner.record(name, time.perf_counter() - start_time, hit)
+            results[name] = hit
+
+        self.results = results
+        return self.score(results) >= self.threshold
+
+    def check_concurrent(self, timeouts: Dict[str, float]) -> bool:
+        """Run all detectors in parallel, each bounded by its own deadline"""
+        if self.executor is None:
+            self.executor = ProbeExecutor(max_workers=len(self.detectors))
+
+        probes = {name: self.probe(name) for name in self.detectors}
+        results, durations = self.executor.run(
+            probes, timeouts, stop_when=lambda partial: self.score(partial) >= self.threshold)
+        for name, duration in durations.items():
+            self.planner.record(name, duration, bool(results[name]))
+
+        # Detectors that missed their deadline stay None ("unknown")
+        self.results = results
+        return self.score(results) >= self.threshold
+
+    def shutdown(self):
+        """Stop the thread pool if one was started"""
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
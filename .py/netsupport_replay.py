@@ -0,0 +1,220 @@
+# netsupport_replay.py - Record and replay process/socket snapshots for perf runs
+import gzip
+import json
+import socket
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import psutil
+
+from netsupport_fakeps import FakePsutil, Snicaddr
+from netsupport_runtime import ConnectionStateMachine
+from netsupport_sockets import Addr, Connection
+
+RECORDING_VERSION = 1
+
+
+def socket_key(conn) -> Tuple:
+    """Compact, hashable form of a psutil connection"""
+    laddr = tuple(conn.laddr) if conn.laddr else ()
+    raddr = tuple(conn.raddr) if conn.raddr else ()
+    family = 6 if conn.family == socket.AF_INET6 else 4
+    return (conn.pid, family, laddr[0] if laddr else "", laddr[1] if laddr else 0,
+            raddr[0] if raddr else "", raddr[1] if raddr else 0, conn.status)
+
+
+class SnapshotRecorder:
+    """Writes what the detectors see to a gzip'd JSON-lines recording
+
+    The first line is a header; every following line is one frame holding
+    only the processes and sockets that appeared or disappeared since the
+    previous frame, plus the result the monitor reported for that tick.
+    """
+
+    def __init__(self, path: str, config: Optional[Dict[str, Any]] = None,
+                 flush_every: int = 10):
+        self.path = path
+        self.flush_every = max(1, int(flush_every))
+        self.started = time.monotonic()
+        self.processes: Dict[int, Tuple[str, float]] = {}
+        self.sockets = set()
+        self.frames = 0
+        self.file = gzip.open(path, "wt", encoding="utf-8")
+        header = {
+            "version": RECORDING_VERSION,
+            "started": time.time(),
+            "config": {k: (config or {}).get(k) for k in
+                       ("detection_method", "port", "network_adapter", "scan_interval")},
+            "interfaces": {name: [[6 if addr.family == socket.AF_INET6 else 4, addr.address]
+                                  for addr in addrs
+                                  if addr.family in (socket.AF_INET, socket.AF_INET6)]
+                           for name, addrs in psutil.net_if_addrs().items()},
+        }
+        self.file.write(json.dumps(header, separators=(",", ":")) + "\n")
+
+    def snapshot(self) -> Tuple[Dict[int, Tuple[str, float]], set]:
+        """Read the full process and socket tables"""
+        processes = {}
+        for proc in psutil.process_iter(["pid", "name", "create_time"], ad_value=None):
+            info = proc.info
+            processes[info["pid"]] = (info.get("name") or "", info.get("create_time") or 0.0)
+        sockets = {socket_key(conn) for conn in psutil.net_connections(kind="inet")}
+        return processes, sockets
+
+    def capture(self, detected: Optional[bool] = None):
+        """Append one frame with the changes since the previous capture"""
+        processes, sockets = self.snapshot()
+
+        frame: Dict[str, Any] = {"t": round(time.monotonic() - self.started, 3)}
+        added = [[pid, name, ctime] for pid, (name, ctime) in processes.items()
+                 if self.processes.get(pid) != (name, ctime)]
+        removed = [pid for pid, entry in self.processes.items()
+                   if processes.get(pid) != entry]
+        if added:
+            frame["add"] = added
+        if removed:
+            frame["del"] = removed
+        sock_added = sockets - self.sockets
+        sock_removed = self.sockets - sockets
+        if sock_added:
+            frame["sadd"] = [list(key) for key in sock_added]
+        if sock_removed:
+            frame["sdel"] = [list(key) for key in sock_removed]
+        if detected is not None:
+            frame["detected"] = detected
+
+        self.processes, self.sockets = processes, sockets
+        self.file.write(json.dumps(frame, separators=(",", ":")) + "\n")
+        self.frames += 1
+        if self.frames % self.flush_every == 0:
+            self.file.flush()
+
+    def close(self):
+        """Flush and close the recording"""
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+def read_recording(path: str) -> Tuple[Dict[str, Any], Iterator[Dict[str, Any]]]:
+    """Return (header, frame iterator) of a recording"""
+    f = gzip.open(path, "rt", encoding="utf-8")
+    header = json.loads(f.readline())
+    if header.get("version") != RECORDING_VERSION:
+        f.close()
+        raise ValueError(f"Unsupported recording version: {header.get('version')}")
+
+    def frames():
+        with f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    return header, frames()
+
+
+class ReplayPsutil(FakePsutil):
+    """FakePsutil whose tables are driven by recorded frames"""
+
+    def __init__(self, header: Optional[Dict[str, Any]] = None):
+        super().__init__()
+        self.socket_table: Dict[Tuple, Connection] = {}
+        interfaces = (header or {}).get("interfaces")
+        if interfaces:
+            self.interfaces = {
+                name: [Snicaddr(socket.AF_INET6 if family == 6 else socket.AF_INET,
+                                address, None, None, None) for family, address in addrs]
+                for name, addrs in interfaces.items()
+            }
+
+    def apply(self, frame: Dict[str, Any]):
+        """Apply one frame's process and socket changes"""
+        for pid in frame.get("del", ()):
+            self.processes.pop(pid, None)
+        for pid, name, ctime in frame.get("add", ()):
+            self.add_process(name, pid=pid, create_time=ctime)
+
+        if "sdel" in frame or "sadd" in frame:
+            for key in frame.get("sdel", ()):
+                self.socket_table.pop(tuple(key), None)
+            for key in frame.get("sadd", ()):
+                pid, family, lip, lport, rip, rport, status = key
+                self.socket_table[tuple(key)] = Connection(
+                    -1, socket.AF_INET6 if family == 6 else socket.AF_INET, socket.SOCK_STREAM,
+                    Addr(lip, lport), Addr(rip, rport) if rip else (), status, pid)
+
+            sockets_by_pid: Dict[Optional[int], List[Connection]] = {}
+            for conn in self.socket_table.values():
+                sockets_by_pid.setdefault(conn.pid, []).append(conn)
+            self.sockets_by_pid = sockets_by_pid
+
+
+def replay(module, path: str, speed: float = 0.0,
+           config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Drive a monitor module's detection through a recording
+
+    Every frame is one `check_connection()` call fed through the debounce
+    state machine. With `speed` > 0 the recorded gaps between frames are
+    slept through, divided by `speed`; 0 replays as fast as possible.
+    Monitors from before the detector API (no `build_detection`) are driven
+    through `check_connection()` alone and debounced here, so old and new
+    versions can be compared on the same recording.
+    """
+    import netsupport_fakeps
+
+    header, frames = read_recording(path)
+    backend = ReplayPsutil(header)
+    previous = netsupport_fakeps.install(backend, module)
+    try:
+        monitor = module.NetSupportMonitorSimple()
+        monitor.config.update({k: v for k, v in header.get("config", {}).items() if v is not None})
+        detector_api = hasattr(monitor, "build_detection")
+        if detector_api:
+            monitor.config.update({"port_backend": "psutil", "event_source": "off"})
+        monitor.config.update(config or {})
+        if detector_api:
+            monitor.detection = monitor.build_detection()
+
+        state = getattr(monitor, "connection_state", None)
+        if state is None:
+            state = ConnectionStateMachine(monitor.config.get("connect_confirmations", 1),
+                                           monitor.config.get("disconnect_confirmations", 2))
+        state.reset(False)
+
+        timeline = []
+        latencies = []
+        mismatches = 0
+        last_t = 0.0
+        for index, frame in enumerate(frames):
+            if speed > 0:
+                time.sleep(max(0.0, frame["t"] - last_t) / speed)
+            last_t = frame["t"]
+
+            backend.apply(frame)
+            if hasattr(monitor, "pid_port_probe"):
+                # Replayed frames are closer together than the per-PID socket TTL
+                monitor.pid_port_probe.sockets.clear()
+            if hasattr(monitor, "snapshot_cache"):
+                monitor.snapshot_cache.invalidate()
+            elif hasattr(monitor.get_netsupport_processes, "cache_clear"):
+                # Older monitors keep process scans in an lru_cache keyed by time
+                monitor.get_netsupport_processes.cache_clear()
+            start_time = time.perf_counter()
+            detected = monitor.check_connection()
+            latencies.append(time.perf_counter() - start_time)
+
+            if "detected" in frame and frame["detected"] != detected:
+                mismatches += 1
+            if state.update(detected) is not None:
+                timeline.append({"frame": index, "t": frame["t"], "connected": state.connected})
+        if detector_api:
+            monitor.detection.shutdown()
+    finally:
+        netsupport_fakeps.uninstall(previous)
+
+    return {
+        "frames": len(latencies),
+        "timeline": timeline,
+        "mismatches": mismatches,
+        "latencies": latencies,
+    }
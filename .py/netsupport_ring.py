@@ -0,0 +1,85 @@
+# netsupport_ring.py - Packed connection history ring buffer for the NetSupport tray monitors
+import base64
+import struct
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# start time, duration (seconds), flags
+RECORD = struct.Struct("<dfB")
+FLAG_ENDED = 0x01
+
+DEFAULT_CAPACITY = 1000
+
+
+class HistoryRing:
+    """Fixed-capacity ring of packed (start, duration, flags) records
+
+    Records live in one preallocated bytearray, so appending overwrites the
+    oldest slot instead of copying a list, and memory does not depend on how
+    many connections came before. Date strings are only built by `entries`,
+    when something is displayed.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        self.capacity = max(1, int(capacity))
+        self.buffer = bytearray(self.capacity * RECORD.size)
+        self.head = 0
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def append(self, start: float, duration: float = 0.0, flags: int = 0):
+        """Add a record, overwriting the oldest one when full"""
+        RECORD.pack_into(self.buffer, self.head * RECORD.size, start, duration, flags)
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def end_last(self, duration: float):
+        """Store the duration of the newest record and mark it ended"""
+        if not self.count:
+            return
+        offset = (self.head - 1) % self.capacity * RECORD.size
+        start, _, flags = RECORD.unpack_from(self.buffer, offset)
+        RECORD.pack_into(self.buffer, offset, start, duration, flags | FLAG_ENDED)
+
+    def __iter__(self) -> Iterator[Tuple[float, float, int]]:
+        """Records from oldest to newest"""
+        first = (self.head - self.count) % self.capacity
+        for i in range(self.count):
+            yield RECORD.unpack_from(self.buffer, (first + i) % self.capacity * RECORD.size)
+
+    def entries(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Newest `limit` records formatted for display"""
+        records = list(self)
+        if limit is not None:
+            records = records[-limit:] if limit > 0 else []
+        return [{
+            "timestamp": start,
+            "datetime": datetime.fromtimestamp(start).strftime("%Y-%m-%d %H:%M:%S"),
+            "duration": duration if flags & FLAG_ENDED else None,
+        } for start, duration, flags in records]
+
+    def to_json(self) -> Dict[str, Any]:
+        """Compact on-disk form: capacity plus the packed records, oldest first"""
+        first = (self.head - self.count) % self.capacity * RECORD.size
+        end = first + self.count * RECORD.size
+        if end <= len(self.buffer):
+            data = bytes(self.buffer[first:end])
+        else:
+            data = bytes(self.buffer[first:]) + bytes(self.buffer[:end - len(self.buffer)])
+        return {"capacity": self.capacity, "records": base64.b64encode(data).decode("ascii")}
+
+    @classmethod
+    def load(cls, value: Any, capacity: int = DEFAULT_CAPACITY) -> "HistoryRing":
+        """Rebuild from `to_json` output or a legacy list of history dicts"""
+        ring = cls(capacity)
+        if isinstance(value, dict):
+            data = base64.b64decode(value.get("records", ""))
+            for offset in range(0, len(data) - len(data) % RECORD.size, RECORD.size):
+                ring.append(*RECORD.unpack_from(data, offset))
+        elif isinstance(value, list):
+            for entry in value:
+                if isinstance(entry, dict) and entry.get("timestamp"):
+                    ring.append(float(entry["timestamp"]))
+        return ring
@@ -0,0 +1,78 @@
+# netsupport_rollups.py - Hour/day/week connection rollups for the NetSupport tray monitors
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List
+
+from netsupport_sketch import add, merge, new_sketch
+
+# Buckets kept per period; the oldest are dropped first
+RETENTION = {"hour": 24 * 14, "day": 400, "week": 160}
+
+COUNT, DURATION, MAX_DURATION = 0, 1, 2
+
+
+def bucket_key(period: str, timestamp: float) -> str:
+    """Local-time bucket name: 2024-09-29 14, 2024-09-29 or 2024-W39"""
+    moment = datetime.fromtimestamp(timestamp)
+    if period == "hour":
+        return moment.strftime("%Y-%m-%d %H")
+    if period == "day":
+        return moment.strftime("%Y-%m-%d")
+    year, week, _ = moment.isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def _bucket(rollups: Dict[str, Any], period: str, timestamp: float) -> List[float]:
+    buckets = rollups.setdefault(period, {})
+    key = bucket_key(period, timestamp)
+    bucket = buckets.get(key)
+    if bucket is None:
+        bucket = buckets[key] = [0, 0.0, 0.0]
+        # Keys are added in time order, so the first one is the oldest
+        while len(buckets) > RETENTION[period]:
+            del buckets[next(iter(buckets))]
+    return bucket
+
+
+def add_connection(rollups: Dict[str, Any], timestamp: float):
+    """Count a connection in its hour, day and ISO week"""
+    for period in RETENTION:
+        _bucket(rollups, period, timestamp)[COUNT] += 1
+
+
+def add_session(rollups: Dict[str, Any], start: float, duration: float):
+    """Add a finished session's duration to the buckets it started in"""
+    for period in RETENTION:
+        bucket = _bucket(rollups, period, start)
+        bucket[DURATION] += duration
+        bucket[MAX_DURATION] = max(bucket[MAX_DURATION], duration)
+
+
+def lookup(rollups: Dict[str, Any], period: str, timestamp: float) -> List[float]:
+    """[count, total duration, max duration] of the bucket holding `timestamp`"""
+    return list(rollups.get(period, {}).get(bucket_key(period, timestamp), [0, 0.0, 0.0]))
+
+
+def add_sample(rollups: Dict[str, Any], name: str, timestamp: float, value: float):
+    """Add a value to the `name` sketch of the day holding `timestamp`"""
+    days = rollups.setdefault("sketches", {}).setdefault(name, {})
+    key = bucket_key("day", timestamp)
+    sketch = days.get(key)
+    if sketch is None:
+        sketch = days[key] = new_sketch()
+        while len(days) > RETENTION["day"]:
+            del days[next(iter(days))]
+    add(sketch, value)
+
+
+def merged_sketch(rollups: Dict[str, Any], name: str, start: float, end: float) -> Dict[str, Any]:
+    """One sketch holding every `name` value of the days from `start` to `end`"""
+    days = rollups.get("sketches", {}).get(name, {})
+    merged = new_sketch()
+    day = date.fromtimestamp(start)
+    last = date.fromtimestamp(end)
+    while day <= last:
+        sketch = days.get(day.strftime("%Y-%m-%d"))
+        if sketch:
+            merge(merged, sketch)
+        day += timedelta(days=1)
+    return merged
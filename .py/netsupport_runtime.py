@@ -0,0 +1,379 @@
+# netsupport_runtime.py - Monitor loop helpers for the NetSupport tray monitors
+import asyncio
+import heapq
+import itertools
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+SAFE = "SAFE"
+SUSPECT = "SUSPECT"
+CONNECTED = "CONNECTED"
+DRAINING = "DRAINING"
+
+
+def call_in_loop(loop: asyncio.AbstractEventLoop, callback: Callable[[], None]):
+    """Run `callback` on `loop` from any thread, or right away once the loop is closed"""
+    try:
+        loop.call_soon_threadsafe(callback)
+    except RuntimeError:
+        callback()
+
+
+class ConnectionStateMachine:
+    """Debounces raw check results into confirmed connect/disconnect transitions
+
+    SAFE -> SUSPECT -> CONNECTED needs `connect_confirmations` positive checks
+    in a row and CONNECTED -> DRAINING -> SAFE needs `disconnect_confirmations`
+    negative checks in a row. Only the regular scheduled checks are fed in,
+    so debouncing never costs an extra scan.
+    """
+
+    def __init__(self, connect_confirmations: int = 1, disconnect_confirmations: int = 2):
+        self.connect_confirmations = max(1, int(connect_confirmations))
+        self.disconnect_confirmations = max(1, int(disconnect_confirmations))
+        self.state = SAFE
+        self.streak = 0
+
+    @property
+    def connected(self) -> bool:
+        """Confirmed status: True from CONNECTED until SAFE is confirmed"""
+        return self.state in (CONNECTED, DRAINING)
+
+    @property
+    def settling(self) -> bool:
+        """True while a transition is waiting for confirmation"""
+        return self.state in (SUSPECT, DRAINING)
+
+    def reset(self, connected: bool):
+        """Force a confirmed state, e.g. after the initial scan"""
+        self.state = CONNECTED if connected else SAFE
+        self.streak = 0
+
+    def update(self, detected: bool) -> Optional[bool]:
+        """Feed one check result; return the new status on a confirmed transition"""
+        if self.state in (SAFE, SUSPECT):
+            if not detected:
+                self.state, self.streak = SAFE, 0
+                return None
+            self.streak += 1
+            if self.streak >= self.connect_confirmations:
+                self.state, self.streak = CONNECTED, 0
+                return True
+            self.state = SUSPECT
+            return None
+
+        if detected:
+            self.state, self.streak = CONNECTED, 0
+            return None
+        self.streak += 1
+        if self.streak >= self.disconnect_confirmations:
+            self.state, self.streak = SAFE, 0
+            return False
+        self.state = DRAINING
+        return None
+
+
+class AdaptiveScanScheduler:
+    """Scan pacing that backs off while nothing happens
+
+    Every quiet tick multiplies the interval by `backoff` up to
+    `max_interval`. An active session, a pending transition or a weak signal
+    (see `burst`) snaps it back to `base_interval`. Each delay is spread by
+    +/- `jitter` so identically imaged machines do not scan in lockstep.
+    """
+
+    def __init__(self, base_interval: float = 2.0, max_interval: float = 30.0,
+                 backoff: float = 2.0, jitter: float = 0.1, minimum: float = 0.5,
+                 seed: Optional[int] = None):
+        self.random = random.Random(seed)
+        self.minimum = minimum
+        self.interval = 0.0
+        self.pending_burst = False
+        self.configure(base_interval, max_interval, backoff, jitter)
+
+    def configure(self, base_interval: float, max_interval: float, backoff: float, jitter: float):
+        """Apply new pacing settings without losing the current backoff level"""
+        self.base_interval = max(self.minimum, float(base_interval))
+        self.max_interval = max(self.base_interval, float(max_interval))
+        self.backoff = max(1.0, float(backoff))
+        self.jitter = min(0.5, max(0.0, float(jitter)))
+        self.interval = min(max(self.interval, self.base_interval), self.max_interval)
+
+    def burst(self):
+        """Return to the fastest interval at the next tick (thread-safe)"""
+        self.pending_burst = True
+
+    def next_delay(self, active: bool, signal: bool = False) -> float:
+        """Seconds to wait before the next scan"""
+        if active or signal or self.pending_burst:
+            self.pending_burst = False
+            self.interval = self.base_interval
+        else:
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+
+        spread = self.interval * self.jitter
+        return max(self.minimum, self.interval + self.random.uniform(-spread, spread))
+
+
+class Job:
+    """One periodic task owned by a DeadlineScheduler"""
+
+    def __init__(self, name: str, interval: float, callback: Callable[[], Optional[float]],
+                 offload: bool = False):
+        self.name = name
+        self.interval = float(interval)
+        self.callback = callback
+        self.offload = offload
+        self.due = 0.0
+        self.generation = 0
+        self.running = False
+        self.rerun = False
+        self.runs = 0
+        self.skipped = 0
+        self.timeouts = 0
+        self.last_duration = 0.0
+
+
+class DeadlineScheduler:
+    """Runs periodic jobs from one thread off a heap of monotonic deadlines
+
+    The next deadline is computed from the previous one, not from when the
+    job finished, so run time does not accumulate as drift. Runs missed
+    while the process was stalled (suspend, long job) are skipped rather
+    than replayed back to back. A callback may return a float to set its own
+    next interval. The thread sleeps on `wake` until the earliest deadline;
+    `trigger` makes a job due immediately from any thread.
+    """
+
+    def __init__(self, wake: Optional[threading.Event] = None, clock: Callable[[], float] = time.monotonic):
+        self.wake = wake or threading.Event()
+        # Replaced by AsyncRuntime so other threads can wake the event loop
+        self.notify: Callable[[], None] = self.wake.set
+        self.clock = clock
+        self.jobs: Dict[str, Job] = {}
+        self.heap: List[Tuple[float, int, str, int]] = []
+        self.counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def _push(self, job: Job, due: float):
+        job.due = due
+        job.generation += 1
+        heapq.heappush(self.heap, (due, next(self.counter), job.name, job.generation))
+
+    def add(self, name: str, interval: float, callback: Callable[[], Optional[float]],
+            delay: float = 0.0, offload: bool = False):
+        """Register a job that first runs after `delay` seconds
+
+        `offload` marks blocking jobs that AsyncRuntime runs in its thread pool.
+        """
+        job = Job(name, interval, callback, offload)
+        with self._lock:
+            self.jobs[name] = job
+            self._push(job, self.clock() + delay)
+        self.notify()
+
+    def set_interval(self, name: str, interval: float):
+        """Change a job's interval from its next run on"""
+        job = self.jobs.get(name)
+        if job is not None:
+            job.interval = float(interval)
+
+    def trigger(self, name: str):
+        """Make a job due now and wake the scheduler thread"""
+        with self._lock:
+            job = self.jobs.get(name)
+            if job is None:
+                return
+            self._push(job, self.clock())
+        self.notify()
+
+    def interrupt(self):
+        """Wake the scheduler so it notices a shutdown"""
+        self.notify()
+
+    def pop_due(self) -> Tuple[Optional[Tuple[Job, float, int]], float]:
+        """Take the next due job off the heap and mark it running
+
+        Returns ((job, due, generation), 0.0), or (None, seconds until the
+        next deadline) when nothing is due.
+        """
+        with self._lock:
+            while self.heap:
+                due, _, name, generation = self.heap[0]
+                now = self.clock()
+                if due > now:
+                    return None, due - now
+                heapq.heappop(self.heap)
+                job = self.jobs.get(name)
+                if job is None or generation != job.generation:
+                    continue
+                if job.running:
+                    # Triggered while running: run again once it returns
+                    job.rerun = True
+                    continue
+                job.running = True
+                return (job, due, generation), 0.0
+            return None, 3600.0
+
+    def finish(self, job: Job, due: float, generation: int, result: Optional[float],
+               start_time: float, finished: float):
+        """Record a finished run and push the job's next deadline"""
+        interval = job.interval
+        if result is not None:
+            interval = job.interval = float(result)
+        job.runs += 1
+        job.last_duration = finished - start_time
+
+        with self._lock:
+            job.running = False
+            if job.rerun or generation != job.generation:
+                # Triggered while running: run again right away
+                job.rerun = False
+                self._push(job, finished)
+                return
+            interval = max(0.001, interval)
+            next_due = due + interval
+            if next_due <= finished:
+                missed = int((finished - next_due) // interval) + 1
+                job.skipped += missed
+                next_due += missed * interval
+            self._push(job, next_due)
+
+    def run_due(self) -> float:
+        """Run every job that is due; return seconds until the next deadline"""
+        while True:
+            entry, delay = self.pop_due()
+            if entry is None:
+                return delay
+            job, due, generation = entry
+
+            start_time = self.clock()
+            result = None
+            try:
+                result = job.callback()
+            except Exception as e:
+                print(f"Job {job.name} error: {e}")
+            self.finish(job, due, generation, result, start_time, self.clock())
+
+    def run(self, running: Callable[[], bool]):
+        """Run jobs until `running()` returns False"""
+        while running():
+            delay = self.run_due()
+            if not running():
+                break
+            self.wake.wait(delay)
+            self.wake.clear()
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """Per-job interval, counters and time until the next run"""
+        now = self.clock()
+        return {
+            name: {
+                "interval": round(job.interval, 2),
+                "due_in": round(max(0.0, job.due - now), 2),
+                "runs": job.runs,
+                "skipped": job.skipped,
+                "timeouts": job.timeouts,
+                "last_ms": round(job.last_duration * 1000, 3),
+            }
+            for name, job in self.jobs.items()
+        }
+
+
+class AsyncRuntime:
+    """Runs the jobs of a DeadlineScheduler as tasks on one asyncio event loop
+
+    Jobs added with `offload=True` (blocking psutil work) run in a small
+    thread pool and are awaited with the per-job timeout from `timeouts`;
+    every other job runs inline on the loop. A job that timed out keeps its
+    slot until its thread returns, so it never overlaps with itself.
+    `on_start` is awaited once the loop runs, so event sources and servers
+    can register their file descriptors on it instead of owning threads.
+    """
+
+    def __init__(self, scheduler: DeadlineScheduler, timeouts: Optional[Dict[str, float]] = None,
+                 max_workers: int = 2):
+        self.scheduler = scheduler
+        self.timeouts = timeouts or {}
+        self.max_workers = max(1, int(max_workers))
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.wakeup: Optional[asyncio.Event] = None
+
+    def run(self, running: Callable[[], bool],
+            on_start: Optional[Callable[[asyncio.AbstractEventLoop], Awaitable[None]]] = None):
+        """Run the event loop in the calling thread until `running()` returns False"""
+        asyncio.run(self.main(running, on_start))
+
+    def wake(self):
+        """Wake the event loop from any thread"""
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    async def main(self, running: Callable[[], bool],
+                   on_start: Optional[Callable[[asyncio.AbstractEventLoop], Awaitable[None]]] = None):
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="netsupport-job")
+        previous_notify = self.scheduler.notify
+        self.scheduler.notify = self.wake
+        tasks = set()
+        try:
+            if on_start is not None:
+                await on_start(self.loop)
+            while running():
+                while True:
+                    entry, delay = self.scheduler.pop_due()
+                    if entry is None:
+                        break
+                    task = self.loop.create_task(self.run_job(entry, executor))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+        finally:
+            self.scheduler.notify = previous_notify
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            executor.shutdown(wait=False)
+
+    async def run_job(self, entry: Tuple[Job, float, int], executor: ThreadPoolExecutor):
+        """Run one due job and schedule its next deadline"""
+        job, due, generation = entry
+        clock = self.scheduler.clock
+        start_time = clock()
+
+        def done(result: Optional[float]):
+            self.scheduler.finish(job, due, generation, result, start_time, clock())
+            self.wakeup.set()
+
+        if not job.offload:
+            result = None
+            try:
+                result = job.callback()
+            except Exception as e:
+                print(f"Job {job.name} error: {e}")
+            done(result)
+            return
+
+        future = self.loop.run_in_executor(executor, job.callback)
+        try:
+            result = await asyncio.wait_for(asyncio.shield(future), self.timeouts.get(job.name))
+        except asyncio.TimeoutError:
+            job.timeouts += 1
+            print(f"Job {job.name} timed out after {self.timeouts.get(job.name)}s")
+            # The thread cannot be interrupted; free the slot when it returns
+            future.add_done_callback(
+                lambda f: done(None if f.cancelled() or f.exception() else f.result()))
+            return
+        except Exception as e:
+            print(f"Job {job.name} error: {e}")
+            result = None
+        done(result)
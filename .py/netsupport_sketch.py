@@ -0,0 +1,75 @@
+# netsupport_sketch.py - Streaming log-bucket quantile sketch for the NetSupport tray monitors
+import math
+from typing import Any, Dict, Optional
+
+# Relative error of every reported quantile
+DEFAULT_ACCURACY = 0.02
+# Values at or below this many seconds go into the zero bucket
+MIN_VALUE = 1e-3
+
+
+def new_sketch(accuracy: float = DEFAULT_ACCURACY) -> Dict[str, Any]:
+    """Empty sketch as a JSON-ready dict"""
+    return {"accuracy": accuracy, "zero": 0, "offset": 0, "counts": []}
+
+
+def _gamma(sketch: Dict[str, Any]) -> float:
+    accuracy = sketch["accuracy"]
+    return (1 + accuracy) / (1 - accuracy)
+
+
+def add(sketch: Dict[str, Any], value: float, count: int = 1):
+    """Add a value: bucket i holds (gamma^(i-1), gamma^i]
+
+    Bucket indexes are logarithmic, so seconds to months fit in a few
+    hundred counters and memory stays constant however many values arrive.
+    """
+    if value <= MIN_VALUE:
+        sketch["zero"] += count
+        return
+    index = math.ceil(math.log(value) / math.log(_gamma(sketch)))
+    counts = sketch["counts"]
+    if not counts:
+        sketch["offset"] = index
+        counts.append(0)
+    elif index < sketch["offset"]:
+        counts[0:0] = [0] * (sketch["offset"] - index)
+        sketch["offset"] = index
+    elif index >= sketch["offset"] + len(counts):
+        counts.extend([0] * (index - sketch["offset"] - len(counts) + 1))
+    counts[index - sketch["offset"]] += count
+
+
+def total(sketch: Dict[str, Any]) -> int:
+    """Number of values added"""
+    return sketch["zero"] + sum(sketch["counts"])
+
+
+def quantile(sketch: Dict[str, Any], q: float) -> Optional[float]:
+    """Value at quantile `q` (0..1) within the sketch accuracy, None when empty"""
+    n = total(sketch)
+    if not n:
+        return None
+    rank = q * (n - 1)
+    seen = sketch["zero"]
+    if rank < seen:
+        return 0.0
+    gamma = _gamma(sketch)
+    for position, count in enumerate(sketch["counts"]):
+        seen += count
+        if rank < seen:
+            # Midpoint of the bucket in relative terms
+            return 2 * gamma ** (sketch["offset"] + position) / (gamma + 1)
+    return 2 * gamma ** (sketch["offset"] + len(sketch["counts"]) - 1) / (gamma + 1)
+
+
+def merge(sketch: Dict[str, Any], other: Dict[str, Any]):
+    """Add all values of `other` (same accuracy) into `sketch`"""
+    if other["accuracy"] != sketch["accuracy"]:
+        raise ValueError("Cannot merge sketches with different accuracy")
+    sketch["zero"] += other["zero"]
+    gamma = _gamma(other)
+    for position, count in enumerate(other["counts"]):
+        if count:
+            # Any value inside the bucket maps back to the same index
+            add(sketch, gamma ** (other["offset"] + position - 0.5), count)
@@ -0,0 +1,306 @@
+# netsupport_sockets.py - Port probe backends for the NetSupport tray monitors
+import socket
+import struct
+import sys
+import time
+from collections import namedtuple
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import psutil
+
+# Same field names as psutil's connection tuples so callers can filter both
+Addr = namedtuple("Addr", ["ip", "port"])
+Connection = namedtuple("Connection", ["fd", "family", "type", "laddr", "raddr", "status", "pid"])
+
+LINUX = sys.platform.startswith("linux")
+
+# linux/netlink.h, linux/sock_diag.h, linux/inet_diag.h
+NETLINK_SOCK_DIAG = 4
+SOCK_DIAG_BY_FAMILY = 20
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+INET_DIAG_REQ_BYTECODE = 1
+INET_DIAG_BC_S_GE = 2
+INET_DIAG_BC_S_LE = 3
+TCP_ESTABLISHED = 1
+TCP_LISTEN = 10
+
+# Kernel TCP state numbers as psutil names them
+TCP_STATES = {TCP_ESTABLISHED: "ESTABLISHED", TCP_LISTEN: "LISTEN"}
+
+NLMSG_HEADER = struct.Struct("=IHHII")
+INET_DIAG_REQ_V2 = struct.Struct("=BBBBI48s")
+INET_DIAG_BC_OP = struct.Struct("=BBH")
+NLATTR_HEADER = struct.Struct("=HH")
+
+
+def port_bytecode(port: int) -> bytes:
+    """inet_diag bytecode that accepts sockets whose local port equals `port`
+
+    Encoded as `sport >= port && sport <= port`; the S_GE/S_LE ops are
+    supported by every kernel with sock_diag, unlike the newer S_EQ op.
+    A `no` jump past the end of the program rejects the socket.
+    """
+    return b"".join([
+        INET_DIAG_BC_OP.pack(INET_DIAG_BC_S_GE, 8, 20),
+        INET_DIAG_BC_OP.pack(0, 0, port),
+        INET_DIAG_BC_OP.pack(INET_DIAG_BC_S_LE, 8, 12),
+        INET_DIAG_BC_OP.pack(0, 0, port),
+    ])
+
+
+def build_diag_request(family: int, port: int, seq: int, state: int = TCP_ESTABLISHED) -> bytes:
+    """Build a SOCK_DIAG_BY_FAMILY dump request for TCP sockets in `state` on `port`"""
+    bytecode = port_bytecode(port)
+    payload = (INET_DIAG_REQ_V2.pack(family, socket.IPPROTO_TCP, 0, 0,
+                                     1 << state, b"") +
+               NLATTR_HEADER.pack(NLATTR_HEADER.size + len(bytecode), INET_DIAG_REQ_BYTECODE) +
+               bytecode)
+    header = NLMSG_HEADER.pack(NLMSG_HEADER.size + len(payload), SOCK_DIAG_BY_FAMILY,
+                               NLM_F_REQUEST | NLM_F_DUMP, seq, 0)
+    return header + payload
+
+
+def parse_diag_message(data: bytes, offset: int) -> Connection:
+    """Decode one inet_diag_msg into a Connection"""
+    family = data[offset]
+    state = TCP_STATES.get(data[offset + 1], "NONE")
+    sport, dport = struct.unpack_from(">HH", data, offset + 4)
+    size = 4 if family == socket.AF_INET else 16
+    src = socket.inet_ntop(family, data[offset + 8:offset + 8 + size])
+    dst = socket.inet_ntop(family, data[offset + 24:offset + 24 + size])
+    return Connection(-1, family, socket.SOCK_STREAM, Addr(src, sport),
+                      Addr(dst, dport) if state != "LISTEN" else (), state, None)
+
+
+def netlink_sockets(port: int, state: int = TCP_ESTABLISHED,
+                    timeout: float = 1.0) -> List[Connection]:
+    """Ask the kernel for TCP sockets in `state` on local `port` via sock_diag"""
+    connections = []
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_SOCK_DIAG)
+    try:
+        sock.settimeout(timeout)
+        for seq, family in enumerate((socket.AF_INET, socket.AF_INET6), start=1):
+            sock.send(build_diag_request(family, port, seq, state))
+            done = False
+            while not done:
+                data = sock.recv(65536)
+                offset = 0
+                while offset + NLMSG_HEADER.size <= len(data):
+                    length, msg_type, _, _, _ = NLMSG_HEADER.unpack_from(data, offset)
+                    if length < NLMSG_HEADER.size:
+                        done = True
+                        break
+                    if msg_type == NLMSG_DONE:
+                        done = True
+                        break
+                    if msg_type == NLMSG_ERROR:
+                        errno = -struct.unpack_from("=i", data, offset + NLMSG_HEADER.size)[0]
+                        if errno:
+                            raise OSError(errno, "sock_diag request failed")
+                        done = True
+                        break
+                    connections.append(parse_diag_message(data, offset + NLMSG_HEADER.size))
+                    offset += (length + 3) & ~3
+    finally:
+        sock.close()
+    return connections
+
+
+def netlink_established(port: int, timeout: float = 1.0) -> List[Connection]:
+    """Ask the kernel for ESTABLISHED TCP sockets on local `port` via sock_diag"""
+    return netlink_sockets(port, TCP_ESTABLISHED, timeout)
+
+
+def decode_proc_address(value: str) -> Addr:
+    """Decode a /proc/net/tcp{,6} "ADDRESS:PORT" hex pair"""
+    address, port = value.split(":")
+    if len(address) == 8:
+        ip = socket.inet_ntop(socket.AF_INET, struct.pack("=I", int(address, 16)))
+    else:
+        words = [struct.pack("=I", int(address[i:i + 8], 16)) for i in range(0, 32, 8)]
+        ip = socket.inet_ntop(socket.AF_INET6, b"".join(words))
+    return Addr(ip, int(port, 16))
+
+
+def procfs_sockets(port: int, state: int = TCP_ESTABLISHED) -> Iterator[Connection]:
+    """Stream TCP sockets in `state` on local `port` from /proc/net/tcp{,6}"""
+    suffix = ":%04X" % port
+    state_hex = "%02X" % state
+    status = TCP_STATES.get(state, "NONE")
+    for path, family in (("/proc/net/tcp", socket.AF_INET), ("/proc/net/tcp6", socket.AF_INET6)):
+        try:
+            f = open(path, "r", encoding="ascii")
+        except OSError:
+            continue
+        with f:
+            next(f, None)
+            for line in f:
+                fields = line.split(None, 4)
+                # Cheap string checks first; only matching rows are decoded
+                if len(fields) < 4 or fields[3] != state_hex or not fields[1].endswith(suffix):
+                    continue
+                yield Connection(-1, family, socket.SOCK_STREAM, decode_proc_address(fields[1]),
+                                 decode_proc_address(fields[2]), status, None)
+
+
+def procfs_established(port: int) -> Iterator[Connection]:
+    """Stream ESTABLISHED sockets on local `port` from /proc/net/tcp{,6}"""
+    return procfs_sockets(port, TCP_ESTABLISHED)
+
+
+class LinuxPortProbe:
+    """Kernel-filtered port probe for Linux
+
+    Uses sock_diag netlink so only matching sockets ever leave the kernel.
+    If netlink is unavailable (old kernel, seccomp, container policy) the
+    probe switches permanently to streaming /proc/net/tcp{,6}.
+    """
+
+    def __init__(self, backend: str = "auto"):
+        self.backend = "procfs" if backend == "procfs" else "netlink"
+        self.fallback_reason: Optional[str] = None
+
+    def sockets(self, port: int, state: int) -> List[Connection]:
+        """Return TCP sockets in `state` whose local port is `port`"""
+        if self.backend == "netlink":
+            try:
+                return netlink_sockets(port, state)
+            except OSError as e:
+                self.fallback_reason = str(e)
+                self.backend = "procfs"
+                print(f"sock_diag unavailable, using /proc/net/tcp: {e}")
+        return list(procfs_sockets(port, state))
+
+    def established(self, port: int) -> List[Connection]:
+        """Return ESTABLISHED TCP connections whose local port is `port`"""
+        return self.sockets(port, TCP_ESTABLISHED)
+
+    def listening(self, port: int) -> bool:
+        """True if something listens on TCP `port`"""
+        return bool(self.sockets(port, TCP_LISTEN))
+
+
+class PidConnectionProbe:
+    """Port probe narrowed to the sockets of known NetSupport processes
+
+    Socket lists are cached per (pid, create_time) so a recycled PID can never
+    return another process's sockets. Callers still run a system-wide scan
+    every `full_scan_interval` seconds as a fallback.
+    """
+
+    def __init__(self, ttl: float = 1.0, full_scan_interval: float = 30.0):
+        self.ttl = float(ttl)
+        self.full_scan_interval = float(full_scan_interval)
+        self.last_full_scan: Optional[float] = None
+        self.processes: Dict[int, psutil.Process] = {}
+        self.sockets: Dict[Tuple[int, float], Tuple[float, list]] = {}
+
+    def full_scan_due(self) -> bool:
+        """True when the periodic system-wide scan should run"""
+        return (self.last_full_scan is None or
+                time.monotonic() - self.last_full_scan >= self.full_scan_interval)
+
+    def mark_full_scan(self):
+        """Record that a system-wide scan just ran"""
+        self.last_full_scan = time.monotonic()
+
+    def process(self, pid: int) -> psutil.Process:
+        """Return a Process handle, replacing it if the PID was recycled"""
+        proc = self.processes.get(pid)
+        if proc is None or not proc.is_running():
+            proc = psutil.Process(pid)
+            self.processes[pid] = proc
+        return proc
+
+    def connections(self, pids: Iterable[int]) -> list:
+        """Return the inet connections of the given PIDs"""
+        now = time.monotonic()
+        result = []
+        live_keys = set()
+        for pid in pids:
+            try:
+                proc = self.process(pid)
+                key = (pid, proc.create_time())
+                live_keys.add(key)
+
+                cached = self.sockets.get(key)
+                if cached is not None and now - cached[0] < self.ttl:
+                    result.extend(cached[1])
+                    continue
+
+                # psutil 6 renamed Process.connections to net_connections
+                getter = getattr(proc, "net_connections", None) or proc.connections
+                conns = getter(kind="inet")
+                self.sockets[key] = (now, conns)
+                result.extend(conns)
+            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+                self.processes.pop(pid, None)
+
+        # Forget processes that are gone or no longer candidates
+        for key in list(self.sockets):
+            if key not in live_keys:
+                del self.sockets[key]
+        for pid in list(self.processes):
+            if not any(key[0] == pid for key in live_keys):
+                del self.processes[pid]
+        return result
+
+
+class AdapterAddressCache:
+    """Precomputed IPv4/IPv6 address sets per network adapter
+
+    A cheap signature of net_if_stats() is compared every `refresh_interval`
+    seconds and the address sets are only rebuilt when the interface set
+    changed, or at least every `max_age` seconds to pick up DHCP renewals.
+    """
+
+    def __init__(self, refresh_interval: float = 10.0, max_age: float = 60.0):
+        self.refresh_interval = float(refresh_interval)
+        self.max_age = float(max_age)
+        self.signature: Optional[tuple] = None
+        self.last_check: Optional[float] = None
+        self.last_build: Optional[float] = None
+        self.ipv4: Dict[str, frozenset] = {}
+        self.ipv6: Dict[str, frozenset] = {}
+        self.members: Dict[str, frozenset] = {}
+
+    @staticmethod
+    def interface_signature() -> tuple:
+        """Names and link state of all interfaces"""
+        return tuple(sorted((name, stats.isup, stats.mtu)
+                            for name, stats in psutil.net_if_stats().items()))
+
+    def rebuild(self):
+        """Recompute the address sets from net_if_addrs()"""
+        ipv4, ipv6, members = {}, {}, {}
+        for name, addrs in psutil.net_if_addrs().items():
+            v4 = {addr.address for addr in addrs if addr.family == socket.AF_INET}
+            v6 = {addr.address.split("%", 1)[0] for addr in addrs
+                  if addr.family == socket.AF_INET6}
+            ipv4[name] = frozenset(v4)
+            ipv6[name] = frozenset(v6)
+            # Dual-stack sockets report IPv4 peers as IPv4-mapped IPv6
+            members[name] = frozenset(v4 | v6 | {"::ffff:" + ip for ip in v4})
+        self.ipv4, self.ipv6, self.members = ipv4, ipv6, members
+        self.last_build = time.monotonic()
+
+    def refresh(self, force: bool = False):
+        """Rebuild the address sets if the interfaces changed"""
+        now = time.monotonic()
+        if not force and self.last_check is not None and now - self.last_check < self.refresh_interval:
+            return
+        self.last_check = now
+
+        signature = self.interface_signature()
+        stale = self.last_build is None or now - self.last_build >= self.max_age
+        if force or stale or signature != self.signature:
+            self.signature = signature
+            self.rebuild()
+
+    def addresses(self, adapter: str) -> frozenset:
+        """Return every local address of `adapter` for O(1) membership tests"""
+        self.refresh()
+        return self.members.get(adapter, frozenset())
@@ -0,0 +1,586 @@
+# netsupport_status.py - Status publishing for the NetSupport details window
+import asyncio
+import json
+import math
+import mmap
+import os
+import queue
+import socket
+import struct
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from netsupport_runtime import CONNECTED, DRAINING, SAFE, SUSPECT, call_in_loop
+
+# Fields that change on every tick and alone never justify a write
+VOLATILE_FIELDS = ("last_check", "timestamp", "cache", "planner", "jobs", "scan_interval")
+
+# Memory-mapped status record: header, body, then MAX_PROBES probe slots.
+# The seq field is a seqlock counter: odd while the monitor is writing.
+RECORD_MAGIC = b"NSMS"
+RECORD_VERSION = 1
+RECORD_HEADER = struct.Struct("<4sHHQ")
+RECORD_SEQ = struct.Struct("<Q")
+RECORD_SEQ_OFFSET = 8
+RECORD_BODY = struct.Struct("<?B32sddB")
+RECORD_PROBE = struct.Struct("<16sbfI")
+RECORD_TIMESTAMP = struct.Struct("<d")
+RECORD_TIMESTAMP_OFFSET = RECORD_HEADER.size + struct.calcsize("<?B32sd")
+MAX_PROBES = 8
+RECORD_SIZE = RECORD_HEADER.size + RECORD_BODY.size + MAX_PROBES * RECORD_PROBE.size
+STATES = (SAFE, SUSPECT, CONNECTED, DRAINING)
+
+
+def read_seq(data: str) -> Optional[int]:
+    """Sequence number of a published status without parsing the document"""
+    if not data.startswith('{"seq":'):
+        return None
+    try:
+        return int(data[7:data.index(",", 7)])
+    except ValueError:
+        return None
+
+
+class StatusPublisher:
+    """Writes the status file only when it changed or a heartbeat is due
+
+    The document is compact JSON starting with a `seq` number that grows on
+    every write, also across restarts, so readers can tell from the first
+    bytes whether they already parsed it. Writes go to a temp file that is
+    renamed over the status file, so readers never see a partial document.
+    """
+
+    def __init__(self, path: str, heartbeat: float = 10.0,
+                 volatile: Iterable[str] = VOLATILE_FIELDS):
+        self.path = path
+        self.heartbeat = float(heartbeat)
+        self.volatile = frozenset(volatile)
+        self.seq = self.load_seq()
+        self.last_key: Optional[Dict[str, Any]] = None
+        self.last_write: Optional[float] = None
+        self.writes = 0
+        self.skipped = 0
+
+    def load_seq(self) -> int:
+        """Continue the sequence of a status file left by a previous run"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return read_seq(f.read(32)) or 0
+        except OSError:
+            return 0
+
+    def publish(self, status: Dict[str, Any], force: bool = False) -> bool:
+        """Write `status` if it changed or the heartbeat is due; return True if written"""
+        key = {k: v for k, v in status.items() if k not in self.volatile}
+        now = time.monotonic()
+        if (not force and key == self.last_key and self.last_write is not None and
+                now - self.last_write < self.heartbeat):
+            self.skipped += 1
+            return False
+
+        data = json.dumps({"seq": self.seq + 1, **status}, separators=(",", ":"))
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(data)
+        self.replace(tmp_path)
+
+        self.seq += 1
+        self.writes += 1
+        self.last_key = key
+        self.last_write = now
+        return True
+
+    def replace(self, tmp_path: str, attempts: int = 5):
+        """Rename the temp file over the status file
+
+        On Windows the rename fails while a reader has the file open, so it
+        is retried briefly before giving up until the next publish.
+        """
+        for attempt in range(attempts):
+            try:
+                os.replace(tmp_path, self.path)
+                return
+            except PermissionError:
+                if attempt == attempts - 1:
+                    raise
+                time.sleep(0.01)
+
+    def stats(self) -> Dict[str, Any]:
+        """Sequence number and write counters"""
+        return {"seq": self.seq, "writes": self.writes, "skipped": self.skipped}
+
+
+class StatusRecord:
+    """Fixed-layout status record in a memory-mapped file
+
+    Holds the connected flag, state, detection method, last check and
+    timestamp, and per-probe result and timings. Every write is bracketed
+    by two increments of the seq counter (seqlock), so readers in other
+    processes can poll it without locks and detect torn reads.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+        # Grow instead of truncating: an open details window may map the file
+        if os.fstat(self.fd).st_size < RECORD_SIZE:
+            os.ftruncate(self.fd, RECORD_SIZE)
+        self.map = mmap.mmap(self.fd, RECORD_SIZE)
+
+        magic, version, size, seq = RECORD_HEADER.unpack_from(self.map, 0)
+        if magic == RECORD_MAGIC and version == RECORD_VERSION and size == RECORD_SIZE:
+            # Continue the old counter so readers never see a seq repeat
+            self.seq = seq + (seq & 1)
+        else:
+            self.seq = 0
+        RECORD_HEADER.pack_into(self.map, 0, RECORD_MAGIC, RECORD_VERSION, RECORD_SIZE, self.seq)
+
+    def write(self, connected: bool, state: str, method: str, last_check: Optional[float],
+              probes: Dict[str, Tuple[Optional[bool], float, int]]):
+        """Publish one status; `probes` maps name -> (result, avg_ms, runs)"""
+        self.seq += 1
+        RECORD_SEQ.pack_into(self.map, RECORD_SEQ_OFFSET, self.seq)
+
+        items = list(probes.items())[:MAX_PROBES]
+        RECORD_BODY.pack_into(
+            self.map, RECORD_HEADER.size, bool(connected),
+            STATES.index(state) if state in STATES else 0,
+            str(method).encode("utf-8")[:32],
+            float("nan") if last_check is None else float(last_check),
+            time.time(), len(items))
+        offset = RECORD_HEADER.size + RECORD_BODY.size
+        for name, (result, avg_ms, runs) in items:
+            RECORD_PROBE.pack_into(self.map, offset, name.encode("utf-8")[:16],
+                                   -1 if result is None else int(bool(result)),
+                                   float(avg_ms), int(runs))
+            offset += RECORD_PROBE.size
+
+        self.seq += 1
+        RECORD_SEQ.pack_into(self.map, RECORD_SEQ_OFFSET, self.seq)
+
+    def close(self):
+        """Mark the record stale for readers, then unmap and close the file"""
+        if self.map is not None:
+            self.seq += 1
+            RECORD_SEQ.pack_into(self.map, RECORD_SEQ_OFFSET, self.seq)
+            RECORD_TIMESTAMP.pack_into(self.map, RECORD_TIMESTAMP_OFFSET, 0.0)
+            self.seq += 1
+            RECORD_SEQ.pack_into(self.map, RECORD_SEQ_OFFSET, self.seq)
+            self.map.close()
+            self.map = None
+            os.close(self.fd)
+
+
+def decode_record(body: bytes) -> Dict[str, Any]:
+    """Turn the body and probe slots of a status record into a status dict"""
+    connected, state, method, last_check, timestamp, count = RECORD_BODY.unpack_from(body, 0)
+    probes = {}
+    timings = {}
+    offset = RECORD_BODY.size
+    for _ in range(min(count, MAX_PROBES)):
+        name, result, avg_ms, runs = RECORD_PROBE.unpack_from(body, offset)
+        name = name.rstrip(b"\0").decode("utf-8", "replace")
+        probes[name] = "unknown" if result < 0 else bool(result)
+        timings[name] = {"avg_ms": round(avg_ms, 3), "runs": runs}
+        offset += RECORD_PROBE.size
+    return {
+        "connected": connected,
+        "state": STATES[state] if state < len(STATES) else SAFE,
+        "method_used": method.rstrip(b"\0").decode("utf-8", "replace"),
+        "last_check": None if math.isnan(last_check) else last_check,
+        "timestamp": timestamp,
+        "probes": probes,
+        "timings": timings,
+    }
+
+
+class StatusRecordReader:
+    """Lock-free reader of a StatusRecord from any local process
+
+    A read copies the record between two reads of the seq counter and
+    retries when the counter was odd or moved. When the counter did not
+    change since the last read, the previous result is returned without
+    copying or decoding anything. With `max_age`, a record whose last write
+    is older than that many seconds (or that a stopped monitor closed) is
+    reported as unavailable, so a crashed monitor is not shown as current.
+    """
+
+    def __init__(self, path: str, max_age: Optional[float] = None):
+        self.path = path
+        self.max_age = max_age
+        self.map: Optional[mmap.mmap] = None
+        self.seq: Optional[int] = None
+        self.cached: Optional[Dict[str, Any]] = None
+
+    def open(self) -> bool:
+        """Map the record file once the monitor has created it"""
+        if self.map is not None:
+            return True
+        try:
+            with open(self.path, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), RECORD_SIZE, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return False
+        magic, version, size, _ = RECORD_HEADER.unpack_from(mapped, 0)
+        if magic != RECORD_MAGIC or version != RECORD_VERSION or size != RECORD_SIZE:
+            mapped.close()
+            return False
+        self.map = mapped
+        return True
+
+    def read(self, retries: int = 1000) -> Optional[Dict[str, Any]]:
+        """Return the latest consistent status, or None if unavailable"""
+        if not self.open():
+            return None
+        for _ in range(retries):
+            start = RECORD_SEQ.unpack_from(self.map, RECORD_SEQ_OFFSET)[0]
+            if start & 1:
+                time.sleep(0)
+                continue
+            if start == self.seq:
+                return self.fresh(self.cached)
+            body = self.map[RECORD_HEADER.size:RECORD_SIZE]
+            if RECORD_SEQ.unpack_from(self.map, RECORD_SEQ_OFFSET)[0] != start:
+                continue
+            status = decode_record(body)
+            status["seq"] = start
+            self.seq, self.cached = start, status
+            return self.fresh(status)
+        return None
+
+    def fresh(self, status: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """`status`, or None when it is older than `max_age`"""
+        if self.max_age is not None and time.time() - status["timestamp"] > self.max_age:
+            return None
+        return status
+
+    def close(self):
+        """Unmap the record"""
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+
+PIPE_PREFIX = "\\\\.\\pipe\\"
+# Unsent bytes a subscriber on the event loop may pile up before it is dropped
+MAX_PENDING_BYTES = 64 * 1024
+
+
+def default_status_address() -> str:
+    """Named pipe on Windows, Unix socket in the working directory elsewhere"""
+    if sys.platform.startswith("win"):
+        return PIPE_PREFIX + "netsupport_status"
+    return "netsupport_status.sock"
+
+
+class UnixSocketTransport:
+    """Unix domain socket listener; every subscriber gets its own stream"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.sock: Optional[socket.socket] = None
+
+    def listen(self):
+        if os.path.exists(self.path):
+            # Left behind by a monitor that did not shut down cleanly
+            os.unlink(self.path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.path)
+        sock.listen(8)
+        self.sock = sock
+
+    def accept(self):
+        """Block until a subscriber connects; return its (send, close) callables"""
+        conn, _ = self.sock.accept()
+        conn.settimeout(5.0)
+        return conn.sendall, conn.close
+
+    def close(self):
+        if self.sock is not None:
+            sock, self.sock = self.sock, None
+            # accept() has no timeout; a throwaway client unblocks it
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+                    client.connect(self.path)
+            except OSError:
+                pass
+            sock.close()
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+
+class NamedPipeTransport:
+    """Windows named pipe listener built on multiprocessing.connection
+
+    A pipe connection's send_bytes is a plain WriteFile without a length
+    header, so subscribers read the same newline-delimited JSON byte stream
+    as from a Unix socket or the event loop's pipe server.
+    """
+
+    def __init__(self, address: str):
+        self.address = address
+        self.listener = None
+
+    def listen(self):
+        from multiprocessing.connection import Listener
+        self.listener = Listener(self.address, family="AF_PIPE")
+
+    def accept(self):
+        conn = self.listener.accept()
+        return conn.send_bytes, conn.close
+
+    def close(self):
+        if self.listener is not None:
+            listener, self.listener = self.listener, None
+            # accept() cannot be interrupted; a throwaway client unblocks it
+            try:
+                from multiprocessing.connection import Client
+                Client(self.address, family="AF_PIPE").close()
+            except OSError:
+                pass
+            listener.close()
+
+
+def create_transport(address: str):
+    """Pick the transport for a status address"""
+    if address.startswith(PIPE_PREFIX):
+        return NamedPipeTransport(address)
+    if not hasattr(socket, "AF_UNIX"):
+        raise OSError("Unix domain sockets are not supported here; use a named pipe")
+    return UnixSocketTransport(address)
+
+
+class Subscriber:
+    """One connected client with a bounded outgoing queue and a sender thread"""
+
+    def __init__(self, send: Callable[[bytes], None], close: Callable[[], None],
+                 on_close: Callable[["Subscriber"], None], backlog: int = 64):
+        self.send = send
+        self.close = close
+        self.on_close = on_close
+        self.queue: "queue.Queue[Optional[bytes]]" = queue.Queue(maxsize=backlog)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def offer(self, data: Optional[bytes]) -> bool:
+        """Queue a message; False when the client is too slow to keep up"""
+        try:
+            self.queue.put_nowait(data)
+            return True
+        except queue.Full:
+            return False
+
+    def run(self):
+        try:
+            while True:
+                data = self.queue.get()
+                if data is None:
+                    break
+                self.send(data)
+        except (OSError, EOFError, ValueError):
+            pass
+        finally:
+            try:
+                self.close()
+            except OSError:
+                pass
+            self.on_close(self)
+
+
+class StreamSubscriber(asyncio.Protocol):
+    """One subscriber served by the event loop, with no thread of its own"""
+
+    def __init__(self, server: "StatusServer"):
+        self.server = server
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.server.attach(self)
+
+    def data_received(self, data: bytes):
+        pass
+
+    def connection_lost(self, exc: Optional[Exception]):
+        self.server.remove(self)
+
+    def offer(self, data: Optional[bytes]) -> bool:
+        """Write a message; False when the client is too slow to keep up"""
+        if data is None:
+            self.close()
+            return True
+        if self.transport.is_closing() or self.transport.get_write_buffer_size() > MAX_PENDING_BYTES:
+            return False
+        self.transport.write(data)
+        return True
+
+    def close(self):
+        self.transport.close()
+
+
+class StatusServer:
+    """Pushes status messages as newline-delimited JSON to local subscribers
+
+    Connecting is subscribing: a client first receives a snapshot from
+    `snapshot`, then every message passed to `publish`. With `start` each
+    subscriber has its own bounded queue and sender thread; with
+    `start_async` the endpoint and all subscribers live on the event loop.
+    Either way a stalled reader is disconnected instead of slowing down the
+    monitor, and `publish` costs one JSON encode however many readers are
+    attached.
+    """
+
+    def __init__(self, address: str, snapshot: Callable[[], Dict[str, Any]]):
+        self.address = address
+        self.snapshot = snapshot
+        self.transport = None
+        self.running = False
+        self.thread = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.servers: List[Any] = []
+        self.subscribers: List[Any] = []
+        self._lock = threading.Lock()
+
+    @property
+    def clients(self) -> int:
+        return len(self.subscribers)
+
+    def start(self) -> bool:
+        """Start listening; False if the endpoint could not be created"""
+        try:
+            self.transport = create_transport(self.address)
+            self.transport.listen()
+        except (OSError, ImportError) as e:
+            print(f"Status server unavailable: {e}")
+            self.transport = None
+            return False
+        self.running = True
+        self.thread = threading.Thread(target=self.accept_loop, daemon=True)
+        self.thread.start()
+        return True
+
+    async def start_async(self, loop: asyncio.AbstractEventLoop) -> bool:
+        """Serve from the event loop; False if the endpoint could not be created"""
+        try:
+            if self.address.startswith(PIPE_PREFIX):
+                # Proactor loop only; a coroutine since Python 3.8
+                servers = loop.start_serving_pipe(lambda: StreamSubscriber(self), self.address)
+                if asyncio.iscoroutine(servers):
+                    servers = await servers
+            else:
+                if not hasattr(socket, "AF_UNIX"):
+                    raise OSError("Unix domain sockets are not supported here; use a named pipe")
+                if os.path.exists(self.address):
+                    # Left behind by a monitor that did not shut down cleanly
+                    os.unlink(self.address)
+                servers = [await loop.create_unix_server(lambda: StreamSubscriber(self), self.address)]
+        except (OSError, AttributeError, NotImplementedError) as e:
+            print(f"Status server unavailable: {e}")
+            return False
+        self.loop = loop
+        self.servers = list(servers)
+        self.running = True
+        return True
+
+    def stop(self):
+        """Disconnect all subscribers and close the endpoint"""
+        self.running = False
+        with self._lock:
+            subscribers, self.subscribers = self.subscribers, []
+        if self.loop is not None:
+            call_in_loop(self.loop, lambda: self.close_async(subscribers))
+            if not self.address.startswith(PIPE_PREFIX):
+                try:
+                    os.unlink(self.address)
+                except OSError:
+                    pass
+            return
+        for subscriber in subscribers:
+            subscriber.offer(None)
+        if self.transport is not None:
+            self.transport.close()
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout=2)
+
+    def close_async(self, subscribers: List[Any]):
+        """Event loop side of `stop`"""
+        for server in self.servers:
+            server.close()
+        for subscriber in subscribers:
+            subscriber.close()
+
+    @staticmethod
+    def encode(message: Dict[str, Any]) -> bytes:
+        return (json.dumps(message, separators=(",", ":")) + "\n").encode("utf-8")
+
+    def accept_loop(self):
+        while self.running:
+            try:
+                accepted = self.transport.accept()
+            except (OSError, EOFError) as e:
+                if self.running:
+                    print(f"Status server error: {e}")
+                    time.sleep(1)
+                continue
+            if not self.running:
+                # The throwaway client that unblocked accept() in close()
+                accepted[1]()
+                break
+            self.attach(Subscriber(accepted[0], accepted[1], self.remove))
+
+    def attach(self, subscriber):
+        """Send the current snapshot to a new subscriber and start publishing to it"""
+        try:
+            subscriber.offer(self.encode({"type": "snapshot", **self.snapshot()}))
+        except Exception as e:
+            print(f"Status snapshot error: {e}")
+        with self._lock:
+            self.subscribers.append(subscriber)
+
+    def remove(self, subscriber: Subscriber):
+        with self._lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+
+    def publish(self, message: Dict[str, Any]):
+        """Send one message to every subscriber"""
+        if not self.subscribers:
+            return
+        data = self.encode(message)
+        if self.loop is not None:
+            # Transports belong to the event loop thread
+            call_in_loop(self.loop, lambda: self.deliver(data))
+        else:
+            self.deliver(data)
+
+    def deliver(self, data: bytes):
+        """Offer encoded data to every subscriber"""
+        with self._lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            if not subscriber.offer(data):
+                # Too far behind: drop it rather than buffer without bound
+                self.remove(subscriber)
+                subscriber.close()
+
+
+def subscribe(address: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Yield the messages of a running monitor's status server"""
+    address = address or default_status_address()
+    if address.startswith(PIPE_PREFIX):
+        # Opened as a file the pipe is read as a byte stream, whatever the
+        # server wrote per message, so lines are split exactly as on a socket
+        with open(address, "r", encoding="utf-8") as stream:
+            for line in stream:
+                yield json.loads(line)
+        return
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(address)
+    with sock, sock.makefile("r", encoding="utf-8") as stream:
+        for line in stream:
+            yield json.loads(line)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+NetSupport Monitor - Snapshot Record/Replay
+Records the process and socket tables of a real machine and replays them
+through a monitor's detection code, so perf runs and regressions can be
+reproduced on any Linux box.
+"""
+
+import argparse
+import cProfile
+import os
+import pstats
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from netsupport_fakeps import load_monitor_module  # noqa: E402
+from netsupport_replay import SnapshotRecorder, replay  # noqa: E402
+from bench_detection import DEFAULT_MONITOR, percentile  # noqa: E402
+
+
+def resolve_monitor(path: str) -> str:
+    """Find a monitor script given as a path or a name next to this file"""
+    if not os.path.exists(path):
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+    return os.path.abspath(path)
+
+
+def record(args):
+    """Capture the live tables every `--interval` seconds"""
+    recorder = SnapshotRecorder(args.file)
+    print(f"Recording to {args.file} every {args.interval}s (Ctrl+C to stop)")
+    deadline = time.monotonic() + args.duration if args.duration else None
+    try:
+        while deadline is None or time.monotonic() < deadline:
+            recorder.capture()
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        recorder.close()
+    print(f"{recorder.frames} frames written")
+
+
+def print_report(name: str, result):
+    """Print the transitions and latency summary of one replay"""
+    latencies = result["latencies"]
+    print(f"\n{name}: {result['frames']} frames, {len(result['timeline'])} transitions, "
+          f"{result['mismatches']} frames differ from the recorded result")
+    if latencies:
+        print(f"  p50 {percentile(latencies, 50) * 1000:.3f} ms  "
+              f"p99 {percentile(latencies, 99) * 1000:.3f} ms")
+    for entry in result["timeline"]:
+        state = "CONNECTED" if entry["connected"] else "disconnected"
+        print(f"  frame {entry['frame']:>6}  t={entry['t']:>9.3f}s  {state}")
+
+
+def run_replay(args):
+    """Replay a recording through one or two monitor scripts"""
+    recording = os.path.abspath(args.file)
+    monitors = [resolve_monitor(args.monitor)]
+    if args.against:
+        monitors.append(resolve_monitor(args.against))
+
+    # Keep config/stats/status files of the monitor out of the working tree
+    os.chdir(tempfile.mkdtemp(prefix="netsupport_replay_"))
+
+    timelines = []
+    for path in monitors:
+        module = load_monitor_module(path)
+        if args.profile:
+            profiler = cProfile.Profile()
+            result = profiler.runcall(replay, module, recording, args.speed)
+            print_report(os.path.basename(path), result)
+            pstats.Stats(profiler).sort_stats("cumulative").print_stats(args.profile)
+        else:
+            result = replay(module, recording, args.speed)
+            print_report(os.path.basename(path), result)
+        timelines.append([(entry["frame"], entry["connected"]) for entry in result["timeline"]])
+
+    if len(timelines) == 2:
+        if timelines[0] == timelines[1]:
+            print("\nTimelines match")
+        else:
+            print("\nTimelines differ")
+            sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record and replay NetSupport detection input")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    rec = commands.add_parser("record", help="record the live process and socket tables")
+    rec.add_argument("file", help="recording to write (.jsonl.gz)")
+    rec.add_argument("--interval", type=float, default=2.0)
+    rec.add_argument("--duration", type=float, default=0, help="seconds, 0 = until Ctrl+C")
+    rec.set_defaults(func=record)
+
+    play = commands.add_parser("replay", help="replay a recording through a monitor")
+    play.add_argument("file", help="recording to read")
+    play.add_argument("--monitor", default=DEFAULT_MONITOR,
+                      help="monitor script to replay through (default: %(default)s)")
+    play.add_argument("--against", help="second monitor script to compare timelines with")
+    play.add_argument("--speed", type=float, default=0,
+                      help="replay speed multiplier, 0 = as fast as possible")
+    play.add_argument("--profile", type=int, nargs="?", const=25, default=0,
+                      help="profile the replay and print the top N functions")
+    play.set_defaults(func=run_replay)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()